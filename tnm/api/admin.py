@@ -95,4 +95,11 @@ class StopAdmin(admin.OSMGeoAdmin):
     def has_delete_permission(self, request, obj=None):
         return False
 
+    def save_model(self, request, obj, form, change):
+        super(StopAdmin, self).save_model(request, obj, form, change)
+
+        # Let running workers know that the data has changed, so that cached
+        # responses pick up the stop and its predictions.
+        DatasetVersion.objects.create()
+
 admin.site.register(Stop, StopAdmin)
@@ -0,0 +1,96 @@
+import math
+import threading
+
+from collections import OrderedDict
+from django.conf import settings
+
+from api.util import EARTH_RADIUS_M
+
+class ResponseCache(object):
+    """
+    Thread-safe LRU cache of API results with hit and miss counters, bounded
+    both by number of entries and by the estimated size of the results.
+    """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, size = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # Move the entry to the most recently used end.
+            self.entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = estimate_size(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+            # A result that would push out everything else isn't kept.
+            if size > self.max_bytes:
+                return
+
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or \
+                self.bytes > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self.entries),
+                    'max_entries': self.max_entries,
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes}
+
+def estimate_size(value):
+    """
+    Returns roughly how many bytes a result takes when rendered as JSON.
+    Strings, such as encoded polylines, count by their length, and any other
+    value counts as a number.
+    """
+    if isinstance(value, basestring):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v)
+                   for k, v in value.iteritems()) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value) + 2
+    return 16
+
+def snap_to_grid(lat, lng, grid_m):
+    """
+    Returns the (lat, lng) of the center of the grid cell containing a point,
+    for a grid with cells of roughly grid_m meters on each side.
+    """
+    lat_step = math.degrees(grid_m / EARTH_RADIUS_M)
+    lat = round(lat / lat_step) * lat_step
+
+    lng_step = lat_step / max(math.cos(math.radians(lat)), 0.01)
+    lng = round(lng / lng_step) * lng_step
+    return lat, lng
+
+response_cache = ResponseCache(settings.TNM_RESPONSE_CACHE_MAX_ENTRIES,
+                               settings.TNM_RESPONSE_CACHE_MAX_BYTES)
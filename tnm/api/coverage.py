@@ -0,0 +1,115 @@
+import math
+import threading
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import connection
+
+from api.index import get_stop_index
+from api.models import CoverageCell
+from api.util import EARTH_RADIUS_M, distance_sphere
+from api.versions import get_dataset_version_id
+
+def coverage_cell(lat, lng):
+    """
+    Returns the (lat_index, lng_index) of the coverage cell containing a point.
+    """
+    size = settings.TNM_COVERAGE_CELL_SIZE_IN_DEGREES
+    return int(math.floor(lat / size)), int(math.floor(lng / size))
+
+def coverage_cell_center(lat_index, lng_index):
+    size = settings.TNM_COVERAGE_CELL_SIZE_IN_DEGREES
+    return (lat_index + 0.5) * size, (lng_index + 0.5) * size
+
+def build_coverage_cells(points, threshold_m):
+    """
+    Returns the set of coverage cells whose centers lie within threshold_m of
+    the center of a cell containing one of the given (lat, lng) points.
+
+    The result is only as precise as the cell size, which is plenty for
+    telling whether a location is anywhere near the service area.
+    """
+    size = settings.TNM_COVERAGE_CELL_SIZE_IN_DEGREES
+    reach_degrees = math.degrees(threshold_m / EARTH_RADIUS_M)
+    lat_reach = int(math.ceil(reach_degrees / size))
+
+    occupied = set(coverage_cell(lat, lng) for lat, lng in points)
+
+    covered = set()
+    for lat_index, lng_index in occupied:
+        lat, lng = coverage_cell_center(lat_index, lng_index)
+
+        # Cells get narrower towards the poles, so more of them are in reach.
+        poleward_lat = min(89.0, abs(lat) + reach_degrees)
+        lng_reach = int(math.ceil(
+            reach_degrees / math.cos(math.radians(poleward_lat)) / size))
+
+        for i in range(lat_index - lat_reach, lat_index + lat_reach + 1):
+            for j in range(lng_index - lng_reach, lng_index + lng_reach + 1):
+                if (i, j) in covered:
+                    continue
+                cell_lat, cell_lng = coverage_cell_center(i, j)
+                if distance_sphere(lat, lng, cell_lat, cell_lng) <= threshold_m:
+                    covered.add((i, j))
+
+    return covered
+
+_cells = None
+_cells_version = None
+_cells_lock = threading.Lock()
+
+def get_coverage_cells():
+    """
+    Returns the set of covered cells, loading it from the database on first
+    use and whenever builddb produces a new dataset. The set is empty if
+    builddb has not computed coverage yet.
+    """
+    global _cells, _cells_version
+    version = get_dataset_version_id()
+    if _cells is None or _cells_version != version:
+        with _cells_lock:
+            if _cells is None or _cells_version != version:
+                _cells = frozenset(
+                    CoverageCell.objects.values_list('lat_index', 'lng_index'))
+                _cells_version = version
+    return _cells
+
+# Finds which of a list of points have a stop within a distance, using the
+# geography index created by builddb.
+coverage_query = 'SELECT points.point_index FROM (VALUES %(values)s) AS points(point_index, location) WHERE EXISTS (SELECT 1 FROM api_stop WHERE ST_DWithin(geography(api_stop.location), geography(points.location), %%s, false))'
+coverage_value = '(%s, ST_GeomFromEWKB(%s))'
+
+def get_coverage(points):
+    """
+    Returns whether there is transit service anywhere near each of the given
+    (lat, lng) points.
+
+    The coverage raster answers if builddb has computed it. Otherwise points
+    are covered if a stop is within
+    TNM_COVERAGE_AREA_DISTANCE_THRESHOLD_IN_MILES, which the stop index
+    tells if it is enabled, or else one query for all the points.
+    """
+    cells = get_coverage_cells()
+    if cells:
+        return [coverage_cell(lat, lng) in cells for lat, lng in points]
+
+    threshold_m = D(mi=settings.TNM_COVERAGE_AREA_DISTANCE_THRESHOLD_IN_MILES).m
+    if settings.TNM_STOP_INDEX:
+        index = get_stop_index()
+        return [index.any_within(lat, lng, threshold_m) for lat, lng in points]
+
+    if not points:
+        return []
+
+    values = []
+    args = []
+    for point_index, (lat, lng) in enumerate(points):
+        values.append(coverage_value)
+        args.extend([point_index, Point(lng, lat, srid=4326).ewkb])
+    args.append(threshold_m)
+
+    cursor = connection.cursor()
+    cursor.execute(coverage_query % {'values': ', '.join(values)}, args)
+    covered = set(row[0] for row in cursor.fetchall())
+    return [point_index in covered for point_index in range(len(points))]
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+
+class BatchedFileHandler(logging.Handler):
+    """
+    Logging handler that writes to a file from a background thread.
+
+    emit() only puts the record on a queue, so logging never waits for
+    formatting, file locks or disk writes. The writer thread formats queued
+    records and writes them in batches of up to batchSize records, at least
+    every flushInterval seconds. If the queue holds queueSize records,
+    further records are dropped and counted rather than slowing requests
+    down, and a warning with the count is written with the next batch.
+
+    Every worker process appends to the same file, so the handler doesn't
+    rotate it; workers renaming the file on their own would overwrite each
+    other's backups. Rotate it with logrotate instead (see
+    deploy/tnm-logrotate.conf). Like WatchedFileHandler, the file is
+    reopened when it has been moved or deleted. Each batch is appended with
+    a single write, so batches from different workers don't interleave.
+
+    To have messages formatted by the writer thread as well, log a format
+    string and its arguments separately rather than a formatted message:
+
+        logger.info('%(call)s %(duration).2f', logdata)
+
+    """
+    def __init__(self, filename, batchSize=500, flushInterval=1.0,
+                 queueSize=10000, encoding='utf-8'):
+        logging.Handler.__init__(self)
+        self.filename = os.path.abspath(filename)
+        self.batch_size = batchSize
+        self.flush_interval = flushInterval
+        self.encoding = encoding
+        self.queue = Queue.Queue(queueSize)
+        self.dropped = 0
+        self.fd = None
+        self.thread = None
+        self.pid = None
+        self.closed = False
+
+    def start(self):
+        # Threads don't survive a fork, so each uWSGI worker starts its own.
+        self.acquire()
+        try:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.fd = None
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        finally:
+            self.release()
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.acquire()
+            try:
+                self.dropped += 1
+            finally:
+                self.release()
+
+    def run(self):
+        while not self.closed:
+            self.write_batch(self.next_batch())
+
+    def next_batch(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                record = self.queue.get(True, timeout)
+            except Queue.Empty:
+                break
+            if record is None:
+                break
+            batch.append(record)
+        return batch
+
+    def write_batch(self, batch):
+        self.acquire()
+        try:
+            dropped, self.dropped = self.dropped, 0
+        finally:
+            self.release()
+        if dropped:
+            batch.append(logging.LogRecord(
+                self.name or 'logging', logging.WARNING, __file__, 0,
+                '%d log records dropped because the queue was full', (dropped,), None))
+
+        lines = []
+        for record in batch:
+            try:
+                line = self.format(record)
+                if isinstance(line, unicode):
+                    line = line.encode(self.encoding)
+                lines.append(line + '\n')
+            except Exception:
+                self.handleError(record)
+
+        if not lines:
+            return
+
+        data = ''.join(lines)
+        try:
+            self.reopen_if_moved()
+            while data:
+                written = os.write(self.fd, data)
+                data = data[written:]
+        except Exception:
+            self.handleError(batch[0])
+
+    def reopen_if_moved(self):
+        if self.fd is not None:
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                stat = None
+            opened = os.fstat(self.fd)
+            if stat is not None and (stat.st_dev, stat.st_ino) == \
+                (opened.st_dev, opened.st_ino):
+                return
+            os.close(self.fd)
+            self.fd = None
+
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+    def close(self):
+        # Write whatever is still queued before the process exits.
+        self.closed = True
+        if self.thread is not None and self.pid == os.getpid():
+            try:
+                self.queue.put_nowait(None)
+            except Queue.Full:
+                pass
+            self.thread.join(self.flush_interval + 1)
+
+            remaining = []
+            while True:
+                try:
+                    record = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if record is not None:
+                    remaining.append(record)
+            self.write_batch(remaining)
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        logging.Handler.close(self)
+
+class JSONLinesFormatter(logging.Formatter):
+    """
+    Formats each record as one line of JSON, which is cheaper to load into
+    other tools than free text. When a record was logged with a dictionary
+    of arguments, its items become fields of the object; otherwise the
+    formatted message is in the 'message' field.
+    """
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        if isinstance(record.args, dict):
+            data.update(record.args)
+        else:
+            data['message'] = record.getMessage()
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=unicode, separators=(',', ':'))
@@ -0,0 +1,112 @@
+import math
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from django.db import connection
+
+from api.util import GEOGRAPHY_RADIUS_M
+from api.versions import get_dataset_version_id
+
+class StopIndex(object):
+    """
+    In-memory spatial index of api.models.Stop locations.
+
+    Stop coordinates are held in NumPy arrays sorted by latitude. A radius
+    query first narrows the candidates to the band of latitudes that could
+    possibly be within range using a binary search, and then computes exact
+    great circle distances for that band with vectorized haversine math.
+
+    Distances are computed on the same sphere that the nearby queries use,
+    geography without the spheroid, so results match theirs. Queries with
+    ST_Distance_Sphere use a sphere about 23 meters smaller, and differ by a
+    few millimeters at the radii used here.
+
+    Build an index from the current contents of the database like this:
+
+        index = StopIndex.from_database()
+        stop_ids, distances = index.query(lat=38.8951, lng=-77.0363, radius_m=800)
+
+    """
+    def __init__(self, ids, lats, lngs):
+        if numpy is None:
+            raise ImportError('StopIndex requires NumPy')
+
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        order = numpy.argsort(lats, kind='mergesort')
+
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)[order]
+        self.lats = lats[order]
+        self.lat_rad = numpy.radians(self.lats)
+        self.lng_rad = numpy.radians(
+            numpy.asarray(lngs, dtype=numpy.float64)[order])
+        self.cos_lat = numpy.cos(self.lat_rad)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls):
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, ST_Y(location), ST_X(location) FROM api_stop")
+        rows = cursor.fetchall()
+
+        ids = [row[0] for row in rows]
+        lats = [row[1] for row in rows]
+        lngs = [row[2] for row in rows]
+        return cls(ids, lats, lngs)
+
+    def _candidates(self, lat, radius_m):
+        # Every stop within range lies inside this band of latitudes.
+        dlat = math.degrees(radius_m / GEOGRAPHY_RADIUS_M)
+        lo = numpy.searchsorted(self.lats, lat - dlat, side='left')
+        hi = numpy.searchsorted(self.lats, lat + dlat, side='right')
+        return lo, hi
+
+    def _distances(self, lat, lng, lo, hi):
+        lat_rad = math.radians(lat)
+        lng_rad = math.radians(lng)
+
+        sin_dlat = numpy.sin((self.lat_rad[lo:hi] - lat_rad) / 2.0)
+        sin_dlng = numpy.sin((self.lng_rad[lo:hi] - lng_rad) / 2.0)
+        a = sin_dlat * sin_dlat + \
+            math.cos(lat_rad) * self.cos_lat[lo:hi] * sin_dlng * sin_dlng
+        return 2.0 * GEOGRAPHY_RADIUS_M * numpy.arcsin(
+            numpy.sqrt(numpy.minimum(a, 1.0)))
+
+    def query(self, lat, lng, radius_m):
+        """
+        Returns a tuple of (stop ids, distances in meters) for all stops
+        within radius_m of the given point, in no particular order.
+        """
+        lo, hi = self._candidates(lat, radius_m)
+        distances = self._distances(lat, lng, lo, hi)
+        within = distances <= radius_m
+        return self.ids[lo:hi][within], distances[within]
+
+    def any_within(self, lat, lng, radius_m):
+        lo, hi = self._candidates(lat, radius_m)
+        if lo == hi:
+            return False
+        return bool((self._distances(lat, lng, lo, hi) <= radius_m).any())
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+def get_stop_index():
+    """
+    Returns the process-wide stop index, loading it on first use and
+    whenever builddb produces a new dataset.
+    """
+    global _index, _index_version
+    version = get_dataset_version_id()
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = StopIndex.from_database()
+                _index_version = version
+    return _index
@@ -0,0 +1,49 @@
+import time
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from api.views import NearbyView
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--lat',
+            action='store', type='float', dest='lat', default=38.89514,
+            help="Latitude of the query point."),
+        make_option('--lng',
+            action='store', type='float', dest='lng', default=-77.03635,
+            help="Longitude of the query point."),
+        make_option('--repeat',
+            action='store', type='int', dest='repeat', default=20,
+            help="Number of times to run each query (default 20)."),
+    )
+    help = "Compares latency of the legacy and indexed nearby service queries."
+
+    radii = [400, 800, 1600]
+
+    def time_query(self, view, origin, radius, legacy):
+        durations = []
+        for i in range(self.repeat):
+            start = time.time()
+            rows = view.get_service_rows(origin, radius, legacy=legacy)
+            durations.append(time.time() - start)
+
+        durations.sort()
+        return len(rows), 1000 * durations[len(durations) / 2], 1000 * durations[-1]
+
+    def handle_noargs(self, **options):
+        self.repeat = options['repeat']
+        origin = Point(options['lng'], options['lat'], srid=4326)
+        view = NearbyView()
+
+        self.stdout.write("%8s %8s %6s %12s %12s\n" % (
+            'radius', 'query', 'rows', 'median (ms)', 'max (ms)'))
+        for radius in self.radii:
+            for name, legacy in [('legacy', True), ('dwithin', False)]:
+                # Warm up caches before timing.
+                view.get_service_rows(origin, radius, legacy=legacy)
+
+                rows, median, worst = self.time_query(view, origin, radius, legacy)
+                self.stdout.write("%7dm %8s %6d %12.2f %12.2f\n" % (
+                    radius, name, rows, median, worst))
@@ -0,0 +1,65 @@
+import json
+import time
+import zlib
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from api.renderers import msgpack_renderer, renderer
+from api.util import CustomJSONEncoder
+from api.views import NearbyStopsView, NearbyView
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--lat',
+            action='store', type='float', dest='lat', default=38.89514,
+            help="Latitude of the query point."),
+        make_option('--lng',
+            action='store', type='float', dest='lng', default=-77.03635,
+            help="Longitude of the query point."),
+        make_option('--radius',
+            action='store', type='float', dest='radius_m', default=1600,
+            help="Radius of the query in meters (default 1600)."),
+        make_option('--repeat',
+            action='store', type='int', dest='repeat', default=200,
+            help="Number of times to render each payload (default 200)."),
+    )
+    help = "Compares the API renderers with the generic JSON encoder."
+
+    def time_render(self, func, payload):
+        start = time.time()
+        for i in range(self.repeat):
+            data = func(payload)
+        duration = 1000 * (time.time() - start) / self.repeat
+        return len(data), len(zlib.compress(data)), duration
+
+    def handle_noargs(self, **options):
+        self.repeat = options['repeat']
+
+        payloads = []
+        for name, cls in [('nearby', NearbyView), ('stops', NearbyStopsView)]:
+            view = cls()
+            view.lat = options['lat']
+            view.lng = options['lng']
+            view.radius_m = options['radius_m']
+            payloads.append((name, view.get_api_result()))
+
+        encoders = [
+            ('json', lambda payload: json.dumps(payload, cls=CustomJSONEncoder)),
+            ('renderer', renderer.render),
+            ('streaming', lambda payload: ''.join(renderer.iter_render(payload))),
+        ]
+        if msgpack_renderer:
+            encoders.append(('msgpack', msgpack_renderer.render))
+        else:
+            self.stdout.write("msgpack is not installed, skipping MessagePack.\n")
+
+        self.stdout.write("%8s %10s %10s %10s %10s\n" % (
+            'payload', 'encoder', 'bytes', 'zlib bytes', 'time (ms)'))
+        for name, payload in payloads:
+            for encoder_name, func in encoders:
+                if encoder_name == 'streaming' and not isinstance(payload, list):
+                    continue
+                size, compressed_size, duration = self.time_render(func, payload)
+                self.stdout.write("%8s %10s %10d %10d %10.3f\n" % (
+                    name, encoder_name, size, compressed_size, duration))
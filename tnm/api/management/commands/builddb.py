@@ -1,3 +1,5 @@
+import gpolyencode
+
 from difflib import SequenceMatcher
 from django.conf import settings
 from django.contrib.gis.geos import LineString, WKBReader
@@ -6,7 +8,9 @@ from django.core.management.base import NoArgsCommand, CommandError
 from django.db import connection, transaction
 from optparse import make_option
 
-from api.models import Agency, Stop, Route, RouteSegment, ServiceFromStop
+from api.coverage import build_coverage_cells
+from api.models import Agency, CoverageCell, DatasetVersion, Stop, Route, RouteSegment, ServiceFromStop, SimplifiedRouteSegment, \
+    update_num_predictions
 from api.util import enumerate_verbose as ev
 from transitapis.models import Stop as APIStop
 
@@ -40,6 +44,9 @@ class Command(NoArgsCommand):
 
         self.associate_apis()
 
+        # Let running workers know that the data has changed.
+        DatasetVersion.objects.create()
+
     def build_database(self):
         # Warn the user about erasing the database.
         if self.warning:
@@ -58,8 +65,10 @@ Type 'yes' to continue, or 'no' to cancel: """)
         Agency.objects.all().delete()
         Stop.objects.all().delete()
         Route.objects.all().delete()
+        SimplifiedRouteSegment.objects.all().delete()
         RouteSegment.objects.all().delete()
         ServiceFromStop.objects.all().delete()
+        CoverageCell.objects.all().delete()
         self.stdout.write("done.\n")
 
         cursor = connection.cursor()
@@ -76,7 +85,24 @@ Type 'yes' to continue, or 'no' to cancel: """)
 
         # Process GTFS stops, copying primary keys.
         self.stdout.write("Processing stops.\n")
-        cursor.execute("INSERT INTO api_stop(id, name, location) SELECT id, stop_name, location FROM gtfs_stop")
+        cursor.execute("INSERT INTO api_stop(id, name, location, num_predictions) SELECT id, stop_name, location, 0 FROM gtfs_stop")
+        transaction.commit_unless_managed()
+
+        # Index stop locations as geography for nearby queries.
+        cursor.execute("DROP INDEX IF EXISTS api_stop_location_geog")
+        cursor.execute("CREATE INDEX api_stop_location_geog ON api_stop USING GIST(geography(location))")
+        cursor.execute("ANALYZE api_stop")
+        transaction.commit_unless_managed()
+
+        # Compute the area considered to have transit coverage.
+        self.stdout.write("Computing coverage area.\n")
+        cursor.execute("SELECT ST_Y(location), ST_X(location) FROM api_stop")
+        cells = build_coverage_cells(
+            cursor.fetchall(),
+            D(mi=settings.TNM_COVERAGE_AREA_DISTANCE_THRESHOLD_IN_MILES).m)
+        cursor.executemany(
+            "INSERT INTO api_coveragecell(lat_index, lng_index) VALUES (%s, %s)",
+            list(cells))
         transaction.commit_unless_managed()
         
         # Process GTFS patterns.
@@ -119,6 +145,18 @@ Type 'yes' to continue, or 'no' to cancel: """)
                 
                 segment.save()
 
+            # Create simplified polylines for lower zoom levels.
+            encoder = gpolyencode.GPolyEncoder()
+            for segment in self.enumerate_verbose(
+                RouteSegment.objects.all(),
+                "Creating simplified polylines"):
+
+                rows = []
+                for tolerance in settings.TNM_SEGMENT_TOLERANCES:
+                    line = segment.line.simplify(tolerance, preserve_topology=True)
+                    rows.append((segment.id, tolerance, encoder.encode(line.coords)['points']))
+                cursor.executemany("INSERT INTO api_simplifiedroutesegment(segment_id, tolerance, line_encoded) VALUES (%s, %s, %s)", rows)
+                transaction.commit_unless_managed()
 
     def associate_apis(self):
         # Warn the user about erasing the database.
@@ -136,6 +174,7 @@ Type 'yes' to continue, or 'no' to cancel: """)
         
         self.stdout.write("Cleaning TNM database of API associations.\n")
         cursor.execute("DELETE FROM api_stop_predictions")
+        cursor.execute("UPDATE api_stop SET num_predictions = 0")
         transaction.commit_unless_managed() 
       
         # Iterate over each API.
@@ -209,5 +248,8 @@ Type 'yes' to continue, or 'no' to cancel: """)
                 if match:
                     match.predictions.add(stop)
 
+        update_num_predictions()
+        transaction.commit_unless_managed()
+
         stops = Stop.objects.filter(predictions=None)
         print '%s unmatched out of %s' % (len(stops), len(Stop.objects.all()))
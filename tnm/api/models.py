@@ -2,8 +2,12 @@ import gpolyencode
 
 from base64 import b64encode
 from django.contrib.gis.db import models
+from django.db import connection
+from django.db.models.signals import m2m_changed
 from stringfield import StringField
 
+from transitapis.signals import stops_refreshed
+
 class Agency(models.Model):
     name = StringField()
     
@@ -22,10 +26,24 @@ class Agency(models.Model):
         except:
             pass
 
+class DatasetVersion(models.Model):
+    """
+    Created by builddb every time the TNM database changes, so that anything
+    derived from the data can tell when it is out of date.
+    """
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        get_latest_by = 'id'
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.id, self.created)
+
 class Stop(models.Model):
     name = StringField()
     location = models.PointField()
     predictions = models.ManyToManyField('transitapis.Stop')
+    num_predictions = models.IntegerField(default=0, editable=False)
     objects = models.GeoManager()
 
     class Meta:
@@ -49,9 +67,8 @@ class Stop(models.Model):
 
     @property
     def has_predictions(self):
-        if not self.id:
-            return False
-        return len(self.predictions.all()) > 0
+        # Maintained by builddb when stops are associated with transit APIs.
+        return self.num_predictions > 0
 
     def __unicode__(self):
         return self.name
@@ -63,6 +80,67 @@ class Stop(models.Model):
               'has_predictions': self.has_predictions}
         return jd
 
+def update_num_predictions(stop_ids=None):
+    """
+    Stores the number of associated transit API stops on each stop, or on
+    the stops with the given ids, so that serializing a stop doesn't need to
+    query its predictions. Call this whenever transit API stops are deleted;
+    changes to the predictions of a stop recount it automatically.
+    """
+    predictions_field = Stop._meta.get_field('predictions')
+    query = "UPDATE api_stop SET num_predictions = (SELECT count(*) FROM %(table)s WHERE %(table)s.%(column)s = api_stop.id)" % {
+        'table': predictions_field.m2m_db_table(),
+        'column': predictions_field.m2m_column_name()}
+    args = []
+    if stop_ids is not None:
+        stop_ids = list(stop_ids)
+        if not stop_ids:
+            return
+        query += " WHERE api_stop.id IN (%s)" % ', '.join(['%s'] * len(stop_ids))
+        args = stop_ids
+
+    cursor = connection.cursor()
+    cursor.execute(query, args)
+
+def predictions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep num_predictions right when associations are edited, such as in
+    # the admin, rather than only when builddb associates stops.
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        update_num_predictions([instance.pk])
+    elif pk_set is not None:
+        update_num_predictions(pk_set)
+    else:
+        # A transit API stop lost all its stops, which are gone by now.
+        update_num_predictions()
+
+m2m_changed.connect(predictions_changed, sender=Stop.predictions.through)
+
+def api_stops_refreshed(sender, **kwargs):
+    # The replaced transit API stops took their associations with stops
+    # with them, until builddb associates them again. Let running workers
+    # know that the data has changed.
+    update_num_predictions()
+    DatasetVersion.objects.create()
+
+stops_refreshed.connect(api_stops_refreshed)
+
+class CoverageCell(models.Model):
+    """
+    A cell of the coverage raster computed by builddb. A cell exists if its
+    center is within TNM_COVERAGE_AREA_DISTANCE_THRESHOLD_IN_MILES of a stop.
+    """
+    lat_index = models.IntegerField()
+    lng_index = models.IntegerField()
+
+    class Meta:
+        unique_together = ('lat_index', 'lng_index')
+
+    def __unicode__(self):
+        return '%s,%s' % (self.lat_index, self.lng_index)
+
 class Route(models.Model):
     agency = models.ForeignKey(Agency)
     short_name = StringField(null=True, blank=True)
@@ -107,6 +185,21 @@ class RouteSegment(models.Model):
         encoder = gpolyencode.GPolyEncoder()
         self.line_encoded = encoder.encode(self.line.coords)['points']
         super(RouteSegment, self).save(*args, **kwargs)
+
+class SimplifiedRouteSegment(models.Model):
+    """
+    An encoded polyline of a route segment simplified with a given
+    Douglas-Peucker tolerance, in degrees, for display at lower zoom levels.
+    """
+    segment = models.ForeignKey(RouteSegment, related_name='simplified')
+    tolerance = models.FloatField()
+    line_encoded = StringField()
+
+    class Meta:
+        unique_together = ('segment', 'tolerance')
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.segment_id, self.tolerance)
         
 
 class ServiceFromStop(models.Model):
@@ -0,0 +1,73 @@
+import logging
+
+from api.models import Stop
+from api.renderers import renderer
+from transitapis.predictions import fetch_predictions, worst_status
+
+def get_stop_predictions(stops):
+    """
+    Returns a dictionary of JSON dictionaries by stop id for the given stops,
+    with the predictions of every stop that has them grouped by route and
+    destination and the status of each of its transit APIs.
+
+    The transit API stops of all the given stops are asked at the same time,
+    and whatever they answered before the deadline is returned.
+    """
+    logger = logging.getLogger('predictions')
+
+    api_stops = []
+    by_api_stop = {}
+    results = {}
+    for stop in stops:
+        results[stop.id] = stop.json_dict()
+        if stop.has_predictions:
+            for api_stop in stop.predictions.all():
+                api_stops.append(api_stop)
+                by_api_stop.setdefault(api_stop.id, []).append(stop)
+
+    predictions = {}
+    status = {}
+    for api_stop, api_predictions, api_status in fetch_predictions(api_stops):
+        for stop in by_api_stop[api_stop.id]:
+            stop_status = status.setdefault(stop.id, {})
+            stop_status[api_stop.api_name] = worst_status(
+                stop_status.get(api_stop.api_name, None), api_status)
+
+            stop_predictions = predictions.setdefault(stop.id, {})
+            for api_prediction in api_predictions:
+
+                logdata = {
+                    'stop_id': stop.id,
+                    'api_name': api_stop.api_name,
+                    'api_stop_id': api_stop.id,
+                    'stop_name': api_stop.name,
+                    'route': api_prediction.route,
+                    'destination': api_prediction.destination,
+                    'wait': api_prediction.wait
+                }
+                logger.info('%(stop_id)s %(api_stop_id)s "%(stop_name)s" "%(route)s" "%(destination)s" "%(wait)s"', logdata)
+
+                route_dest_pair = (api_prediction.route, api_prediction.destination)
+                if route_dest_pair not in stop_predictions:
+                    stop_predictions[route_dest_pair] = []
+                stop_predictions[route_dest_pair] += [api_prediction.wait]
+
+    for stop_id, stop_status in status.iteritems():
+        jd = results[stop_id]
+        if predictions.get(stop_id):
+            jd['predictions'] = [{
+                'route': k[0],
+                'destination': k[1],
+                'waits': v} for (k,v) in predictions[stop_id].iteritems()]
+        jd['prediction_status'] = stop_status
+
+    return results
+
+def render_stop_predictions(stop_ids):
+    """
+    Returns the predictions of the stops with the given ids, rendered to
+    JSON, by stop id. The prediction gateway streams these to browsers.
+    """
+    stops = Stop.objects.filter(id__in=stop_ids)
+    return dict((stop_id, renderer.render(jd))
+                for stop_id, jd in get_stop_predictions(stops).iteritems())
@@ -0,0 +1,122 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import Distance
+
+from api.models import ServiceFromStop, Stop, Route, RouteSegment
+
+class JSONRenderer(object):
+    """
+    Renders API results to JSON using encoders registered per type.
+
+    Plain dictionaries, lists, strings and numbers are written by the C
+    accelerated encoder from the json module. Any other object is looked up
+    by its exact type in the encoder registry, and the registered function
+    converts it to something JSON serializable. Only objects that have no
+    registered encoder fall back to json_dict and iteration checks.
+
+    Register an encoder for a new type like this:
+
+        renderer.register(Agency, lambda agency: {'name': agency.name})
+
+    """
+    content_type = 'application/json'
+
+    def __init__(self):
+        self.encoders = {}
+        self.encoder = json.JSONEncoder(
+            default=self.default,
+            check_circular=False,
+            separators=(',', ':'))
+
+    def register(self, cls, func):
+        self.encoders[cls] = func
+
+    def default(self, obj):
+        func = self.encoders.get(type(obj), None)
+        if func is None:
+            func = self.lookup(type(obj))
+        return func(obj)
+
+    def lookup(self, cls):
+        # Try base classes, then remember the result for next time.
+        for base in cls.__mro__[1:]:
+            if base in self.encoders:
+                func = self.encoders[base]
+                break
+        else:
+            func = self.fallback
+
+        self.encoders[cls] = func
+        return func
+
+    def fallback(self, obj):
+        # Check if object exposes a JSONable dictionary.
+        json_dict = getattr(obj, 'json_dict', None)
+        if json_dict is not None:
+            if callable(json_dict):
+                return json_dict()
+            return json_dict
+
+        # Try iterating.
+        try:
+            iterable = iter(obj)
+        except TypeError:
+            raise TypeError(repr(obj) + ' is not JSON serializable')
+        return list(iterable)
+
+    def render(self, obj):
+        return self.encoder.encode(obj)
+
+    def iter_render(self, iterable):
+        """
+        Renders a sequence as a JSON list one item at a time, so that large
+        results can be streamed to the client as they are produced.
+        """
+        yield '['
+        first = True
+        for item in iterable:
+            if first:
+                first = False
+            else:
+                yield ','
+            yield self.encoder.encode(item)
+        yield ']'
+
+class MessagePackRenderer(object):
+    """
+    Renders API results to MessagePack, a compact binary encoding that
+    decodes to the same structure as the JSON rendering. Objects that aren't
+    plain data are converted by the encoders registered with a JSONRenderer.
+
+    Requires the msgpack package.
+    """
+    content_type = 'application/x-msgpack'
+
+    def __init__(self, json_renderer):
+        if msgpack is None:
+            raise ImportError('MessagePackRenderer requires msgpack')
+        self.json_renderer = json_renderer
+
+    def render(self, obj):
+        return msgpack.packb(obj, default=self.json_renderer.default)
+
+    def iter_render(self, iterable):
+        yield self.render(list(iterable))
+
+renderer = JSONRenderer()
+renderer.register(Stop, Stop.json_dict)
+renderer.register(Route, Route.json_dict)
+renderer.register(RouteSegment, RouteSegment.json_dict)
+renderer.register(ServiceFromStop, ServiceFromStop.json_dict)
+renderer.register(Point, lambda point: {'lng': point.x, 'lat': point.y})
+renderer.register(Distance, lambda distance: distance.m)
+
+msgpack_renderer = None
+if msgpack is not None:
+    msgpack_renderer = MessagePackRenderer(renderer)
@@ -0,0 +1,101 @@
+from api.models import ServiceFromStop, SimplifiedRouteSegment, Stop, Route, RouteSegment
+
+def serialize_stops(stop_ids):
+    stops = Stop.objects.filter(id__in=stop_ids)
+    return [{'id': stop.id,
+             'name': stop.name,
+             'location': {'lng': stop.location.x, 'lat': stop.location.y},
+             'has_predictions': stop.has_predictions}
+            for stop in stops]
+
+def serialize_routes(route_ids):
+    routes = Route.objects.filter(id__in=route_ids).values_list(
+        'id', 'agency__name', 'short_name', 'long_name', 'route_type', 'color')
+    return [{'id': route[0],
+             'agency': route[1],
+             'short_name': route[2],
+             'long_name': route[3],
+             'route_type': route[4],
+             'color': route[5]}
+            for route in routes]
+
+def serialize_segments(routesegment_ids, tolerance=None):
+    routesegments = []
+    if tolerance is not None:
+        routesegments = list(SimplifiedRouteSegment.objects.filter(
+            segment__in=routesegment_ids,
+            tolerance=tolerance).values_list('segment', 'line_encoded'))
+
+        # Use full resolution for segments that weren't simplified.
+        routesegment_ids = set(routesegment_ids) - set(
+            routesegment[0] for routesegment in routesegments)
+
+    if routesegment_ids:
+        routesegments += RouteSegment.objects.filter(
+            id__in=routesegment_ids).values_list('id', 'line_encoded')
+
+    return [{'id': routesegment[0],
+             'line_encoded': routesegment[1]}
+            for routesegment in routesegments]
+
+def serialize_services(service_segments):
+    services = ServiceFromStop.objects.filter(
+        id__in=service_segments.keys()).values_list(
+        'id', 'stop', 'route', 'destination__name')
+    return [{'id': service[0],
+             'stop': service[1],
+             'route': service[2],
+             'destination': service[3],
+             'segments': service_segments[service[0]]}
+            for service in services]
+
+def serialize_nearby(rows, tolerance=None):
+    """
+    Builds the services, stops, routes and segments of a nearby response
+    from (service id, stop id, route id, segment id) rows.
+
+    Each kind of object is fetched with a single query, and the result
+    contains only plain dictionaries with the same keys as the models'
+    json_dict methods. Segment ids come straight from the rows, so
+    segment links are never queried per service.
+
+    If tolerance is given, segments are simplified with that tolerance.
+    """
+    service_segments = {}
+    stop_ids = set()
+    route_ids = set()
+    routesegment_ids = set()
+    for service_id, stop_id, route_id, routesegment_id in rows:
+        segment_ids = service_segments.setdefault(service_id, [])
+        stop_ids.add(stop_id)
+        route_ids.add(route_id)
+        if routesegment_id is not None and routesegment_id not in segment_ids:
+            segment_ids.append(routesegment_id)
+            routesegment_ids.add(routesegment_id)
+
+    result = {'services': [], 'stops': [], 'routes': [], 'segments': []}
+    if service_segments:
+        result['services'] = serialize_services(service_segments)
+    if stop_ids:
+        result['stops'] = serialize_stops(stop_ids)
+    if route_ids:
+        result['routes'] = serialize_routes(route_ids)
+    if routesegment_ids:
+        result['segments'] = serialize_segments(routesegment_ids, tolerance)
+    return result
+
+def omit_known(result, known):
+    """
+    Returns a copy of a nearby result without the stops, routes and segments
+    the client already has, listing their ids under 'known' instead. known
+    maps 'stops', 'routes' and 'segments' to sets of ids.
+
+    The result itself isn't changed, so it can come from the response cache.
+    """
+    omitted = dict(result)
+    omitted['known'] = {}
+    for key in ('stops', 'routes', 'segments'):
+        ids = known.get(key, set())
+        omitted['known'][key] = [o['id'] for o in result[key] if o['id'] in ids]
+        omitted[key] = [o for o in result[key] if o['id'] not in ids]
+    return omitted
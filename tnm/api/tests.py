@@ -0,0 +1,132 @@
+import json
+import urllib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from django.contrib.gis.geos import LineString, Point
+from django.test import TestCase
+from django.utils.unittest import skipIf
+
+from api import versions
+from api.cache import response_cache
+from api.coverage import coverage_cell
+from api.models import Agency, CoverageCell, DatasetVersion, Route, \
+    RouteSegment, ServiceFromStop, Stop
+from api.renderers import msgpack_renderer, renderer
+from api.serializers import serialize_nearby
+from transitapis.models import Stop as API_Stop
+
+class NearbyQueryCountTest(TestCase):
+    """
+    Nearby responses must take the same small number of queries however many
+    services, stops, routes and segments they contain.
+    """
+    lat, lng = 38.8951, -77.0363
+
+    def setUp(self):
+        agency = Agency.objects.create(name='Metrobus')
+        destination = Stop.objects.create(name='Destination',
+            location=Point(self.lng + 0.05, self.lat, srid=4326))
+
+        self.rows = []
+        for i in range(10):
+            stop = Stop.objects.create(name='Stop %s' % i,
+                location=Point(self.lng + 0.0001 * i, self.lat, srid=4326))
+            route = Route.objects.create(agency=agency,
+                short_name=str(i), route_type=3)
+            service = ServiceFromStop.objects.create(stop=stop, route=route,
+                destination=destination)
+            for j in range(3):
+                segment = RouteSegment(line=LineString(
+                    (self.lng + 0.0001 * i, self.lat + 0.001 * j),
+                    (self.lng + 0.0001 * i, self.lat + 0.001 * (j + 1)),
+                    srid=4326))
+                segment.save()
+                service.segments.add(segment)
+                self.rows.append((service.id, stop.id, route.id, segment.id))
+
+        # Answer coverage from cells, as after builddb.
+        lat_index, lng_index = coverage_cell(self.lat, self.lng)
+        CoverageCell.objects.create(lat_index=lat_index, lng_index=lng_index)
+        DatasetVersion.objects.create()
+        versions._checked = 0
+        response_cache.clear()
+
+    def test_serialize_nearby(self):
+        with self.assertNumQueries(4):
+            result = serialize_nearby(self.rows)
+
+        self.assertEqual(len(result['services']), 10)
+        self.assertEqual(len(result['stops']), 10)
+        self.assertEqual(len(result['routes']), 10)
+        self.assertEqual(len(result['segments']), 30)
+        for service in result['services']:
+            self.assertEqual(len(service['segments']), 3)
+
+    def test_nearby_request(self):
+        params = {'lat': self.lat, 'lng': self.lng, 'radius_m': 500}
+
+        # Load the dataset version and coverage cells, which are kept for
+        # later requests, and start from an empty response cache.
+        self.client.get('/api/nearby', params)
+        response_cache.clear()
+
+        # The service rows, then services, stops, routes and segments.
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/nearby', params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_known_ids_use_cached_result(self):
+        params = {'lat': self.lat, 'lng': self.lng, 'radius_m': 500}
+        full = json.loads(self.client.get('/api/nearby', params).content)
+
+        # Clients POST the ids they have, and get the cached result
+        # without those objects.
+        known_stop = full['stops'][0]['id']
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/nearby?' + urllib.urlencode(params),
+                {'known_stops': str(known_stop)})
+        delta = json.loads(response.content)
+
+        self.assertEqual(delta['known']['stops'], [known_stop])
+        self.assertEqual(len(delta['stops']), len(full['stops']) - 1)
+        self.assertEqual(len(delta['segments']), len(full['segments']))
+
+    def test_out_of_range_zoom(self):
+        for zoom in (5000, -5000):
+            response = self.client.get('/api/nearby', {'lat': self.lat,
+                'lng': self.lng, 'radius_m': 500, 'zoom': zoom})
+            self.assertEqual(response.status_code, 200)
+
+class NumPredictionsTest(TestCase):
+    """
+    Stops must count their transit API stops whenever those change.
+    """
+    def test_predictions_changed(self):
+        location = Point(-77.0363, 38.8951, srid=4326)
+        stop = Stop.objects.create(name='Stop', location=location)
+        api_stop = API_Stop.objects.create(name='Stop', location=location,
+            api_name='WMATA', api_data='1001')
+
+        stop.predictions.add(api_stop)
+        self.assertTrue(Stop.objects.get(pk=stop.pk).has_predictions)
+
+        api_stop.stop_set.clear()
+        self.assertFalse(Stop.objects.get(pk=stop.pk).has_predictions)
+
+class MessagePackRendererTest(TestCase):
+    """
+    MessagePack responses must decode to the same data as JSON responses.
+    """
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_stop_round_trip(self):
+        stop = Stop(id=7, name=u'Metro Center \u2013 G St',
+            location=Point(-77.0363, 38.8951, srid=4326))
+        payload = {'stops': [stop], 'coverage': True}
+
+        data = msgpack_renderer.render(payload)
+        self.assertEqual(msgpack.unpackb(data, use_list=True, encoding='utf-8'),
+            json.loads(renderer.render(payload)))
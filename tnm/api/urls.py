@@ -1,8 +1,11 @@
 from django.conf.urls.defaults import patterns, url
+from django.views.decorators.csrf import csrf_exempt
 from api.views import *
 
 urlpatterns = patterns('api.views',
     url(r'stop/(?P<id>\d+)$', StopView.as_view(), name='stop'),
     url(r'stops$', NearbyStopsView.as_view(), name='stops'),
-    url(r'nearby$', NearbyView.as_view(), name='nearby'),
+    url(r'nearby$', csrf_exempt(NearbyView.as_view()), name='nearby'),
+    url(r'nearby/batch$', csrf_exempt(NearbyBatchView.as_view()), name='nearby-batch'),
+    url(r'cachestats$', CacheStatsView.as_view(), name='cachestats'),
 )
@@ -1,10 +1,18 @@
 import gpolyencode
 import json
+import math
 
 from django.contrib.gis.geos import Point, LineString
 from django.contrib.gis.measure import Distance
 from sys import stdout
 
+# Earth radius used by PostGIS ST_Distance_Sphere, in meters.
+EARTH_RADIUS_M = 6370986.0
+
+# Mean earth radius used by PostGIS for geography distances on a sphere, as
+# in ST_DWithin(geography, geography, distance, false), in meters.
+GEOGRAPHY_RADIUS_M = 6371008.7714
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         # Check if object exposes a JSONable dictionary.
@@ -33,6 +41,18 @@ class CustomJSONEncoder(json.JSONEncoder):
 
         return json.JSONEncoder.default(self, obj)
 
+def distance_sphere(lat1, lng1, lat2, lng2):
+    """
+    Returns the great circle distance in meters between two points, using
+    the same sphere as ST_Distance_Sphere.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    sin_dlat = math.sin((lat2 - lat1) / 2.0)
+    sin_dlng = math.sin((lng2 - lng1) / 2.0)
+    a = sin_dlat * sin_dlat + \
+        math.cos(lat1) * math.cos(lat2) * sin_dlng * sin_dlng
+    return 2.0 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
 def enumerate_verbose(iterable, msg, stream=stdout):
     reported_pct = -1
     try:
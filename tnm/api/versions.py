@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.utils.functional import wraps
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from api.models import DatasetVersion
+
+_version = None
+_checked = 0
+_lock = threading.Lock()
+
+def get_dataset_version():
+    """
+    Returns the latest DatasetVersion, or None if builddb has never run.
+
+    The database is checked at most once every
+    TNM_DATASET_VERSION_CHECK_SECONDS, so this is cheap to call on every
+    request.
+    """
+    global _version, _checked
+    now = time.time()
+    if now - _checked > settings.TNM_DATASET_VERSION_CHECK_SECONDS:
+        with _lock:
+            if now - _checked > settings.TNM_DATASET_VERSION_CHECK_SECONDS:
+                try:
+                    _version = DatasetVersion.objects.latest()
+                except DatasetVersion.DoesNotExist:
+                    _version = None
+                _checked = now
+    return _version
+
+def get_dataset_version_id():
+    version = get_dataset_version()
+    if version is None:
+        return None
+    return version.id
+
+def dataset_etag(request, *extra):
+    """
+    Returns an ETag for a response that only depends on the dataset and the
+    request, or None if builddb has never run.
+    """
+    version_id = get_dataset_version_id()
+    if version_id is None:
+        return None
+
+    parts = [version_id, request.path, request.META.get('QUERY_STRING', '')]
+    parts.extend(extra)
+    return quote_etag(hashlib.md5(
+        ':'.join([unicode(part) for part in parts]).encode('utf-8')).hexdigest())
+
+def dataset_last_modified():
+    """
+    Returns the HTTP date the dataset was built, or None if builddb has
+    never run.
+    """
+    version = get_dataset_version()
+    if version is None:
+        return None
+    return http_date(time.mktime(version.created.timetuple()))
+
+def dataset_conditional(view):
+    """
+    Decorates a view whose responses only depend on the dataset and the
+    request, so that they get an ETag and Last-Modified, and conditional
+    requests are answered with 304 Not Modified.
+    """
+    conditional_view = condition(etag_func=dataset_etag)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        last_modified = dataset_last_modified()
+        if last_modified and response.status_code in (200, 304):
+            response['Last-Modified'] = last_modified
+        return response
+    return wrapper
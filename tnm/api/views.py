@@ -6,26 +6,117 @@ from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
 from django.db import connection
-from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.db.models import F
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+    HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
 from django.views.generic import View
 
-from api.models import ServiceFromStop, Stop, Route, RouteSegment
-from api.util import CustomJSONEncoder
+from api.cache import response_cache, snap_to_grid
+from api.coverage import get_coverage
+from api.index import get_stop_index
+from api.models import ServiceFromStop, Stop
+from api.predictions import get_stop_predictions
+from api.serializers import omit_known, serialize_nearby
+from api.versions import dataset_etag, dataset_last_modified, \
+    get_dataset_version_id
+from api.renderers import msgpack_renderer, renderer
 
-from transitapis.apis import get_apis
+def get_indexed_service_rows(points):
+    """
+    Returns (point index, service id, stop id, route id, segment id) rows for
+    the closest stop within radius of each route and destination, for each of
+    the given (point index, lat, lng, radius) tuples.
+
+    Nearby stops are found in the in-memory stop index, so the database is
+    only asked for the services and segments of those stops, in one query
+    each for all the points.
+    """
+    index = get_stop_index()
+    nearby = []
+    stop_ids = set()
+    for point_index, lat, lng, radius in points:
+        ids, distances = index.query(lat, lng, radius)
+        distances = dict(zip(ids.tolist(), distances.tolist()))
+        nearby.append((point_index, distances))
+        stop_ids.update(distances)
+    if not stop_ids:
+        return []
+
+    services = {}
+    for service in ServiceFromStop.objects.filter(
+        stop__in=stop_ids).exclude(destination=F('stop')).values_list(
+        'id', 'stop', 'route', 'destination'):
+        services.setdefault(service[1], []).append(service)
+
+    # Keep the closest stop for each route and destination, including
+    # ties, just like the SQL queries do.
+    chosen = []
+    for point_index, distances in nearby:
+        closest = {}
+        for stop_id, distance in distances.iteritems():
+            for service in services.get(stop_id, []):
+                key = (service[2], service[3])
+                best = closest.get(key, None)
+                if best is None or distance < best[0]:
+                    closest[key] = (distance, [service])
+                elif distance == best[0]:
+                    best[1].append(service)
+
+        for distance, tied in closest.itervalues():
+            for service in tied:
+                chosen.append((point_index, service))
+
+    segments = {}
+    links = ServiceFromStop.segments.through.objects.filter(
+        servicefromstop__in=set(service[0] for point_index, service in chosen)).values_list(
+        'servicefromstop', 'routesegment')
+    for servicefromstop_id, routesegment_id in links:
+        segments.setdefault(servicefromstop_id, []).append(routesegment_id)
+
+    data = []
+    for point_index, service in chosen:
+        for routesegment_id in segments.get(service[0], [None]):
+            data.append((point_index, service[0], service[1], service[2], routesegment_id))
+    return data
 
 class JSONResponseMixin(object):
+    # Stream list results to the client one item at a time.
+    streaming = False
+
+    def get_renderer(self):
+        # Clients can ask for MessagePack instead of JSON, if it's installed.
+        request = getattr(self, 'request', None)
+        if msgpack_renderer and request:
+            if request.GET.get('format') == 'msgpack' or \
+                msgpack_renderer.content_type in request.META.get('HTTP_ACCEPT', ''):
+                return msgpack_renderer
+        return renderer
+
     def render_to_response(self, content):
-        data = json.dumps(content, cls=CustomJSONEncoder)
-        return HttpResponse(data, content_type='application/json')
+        content_renderer = self.get_renderer()
+        if self.streaming:
+            data = content_renderer.iter_render(content)
+        else:
+            data = content_renderer.render(content)
+
+        response = HttpResponse(data, content_type=content_renderer.content_type)
+        patch_vary_headers(response, ['Accept'])
+        return response
 
 class BaseAPIView(JSONResponseMixin, View):
     params = []
     required_params = params
 
+    # Results that depend only on the dataset get validators and can be
+    # answered with 304 Not Modified.
+    conditional = False
+
+    # Seconds clients and proxies may reuse a response, if set.
+    max_age = None
+
     def get(self, request, *args, **kwargs):
-        logger = logging.getLogger('api')
-        
         # Parse query params.   
         for param in self.params:
             if param in request.GET:
@@ -35,127 +126,324 @@ class BaseAPIView(JSONResponseMixin, View):
             if param not in request.GET:
                 return HttpResponseBadRequest('Required parameters: ' + ', '.join(self.required_params))
 
-        # Perform the API call.
+        # Answer conditional requests without performing the API call.
+        etag = None
+        if self.conditional:
+            etag = dataset_etag(request, self.get_renderer().content_type)
+            if etag is not None and \
+                etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                return self.add_cache_headers(HttpResponseNotModified(), etag)
+
+        # Perform the API call, unless the result is already cached.
         start = time.time()     
-        api_result = self.get_api_result(*args, **kwargs)
+        cache_key = self.get_cache_key(*args, **kwargs)
+        api_result = None
+        if cache_key is not None:
+            api_result = response_cache.get(cache_key)
+        if api_result is None:
+            api_result = self.get_api_result(*args, **kwargs)
+            if cache_key is not None:
+                response_cache.set(cache_key, api_result)
+        api_result = self.get_request_result(api_result)
         duration = time.time() - start
 
+        self.log_call(request, request.META.get('QUERY_STRING', ''), duration)
+                
+        # Return the result.
+        return self.add_cache_headers(self.render_to_response(api_result), etag)
+
+    def add_cache_headers(self, response, etag=None):
+        if etag is not None:
+            response['ETag'] = etag
+            last_modified = dataset_last_modified()
+            if last_modified:
+                response['Last-Modified'] = last_modified
+        if self.max_age is not None:
+            patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
+
+    def log_call(self, request, params, duration):
+        logger = logging.getLogger('api')
         logdata = { 
                 'call': request.path,
-                'params': request.META.get('QUERY_STRING', ''),
+                'params': params,
                 'duration': duration,
                 'ip': request.META.get('REMOTE_ADDR', ''),
                 'ua': request.META.get('HTTP_USER_AGENT', '')
         }
-        logger.info('%(call)s "%(params)s" %(duration).2f "%(ip)s" "%(ua)s"' % logdata)
-                
-        # Return the result.
-        return self.render_to_response(api_result)
+        logger.info('%(call)s "%(params)s" %(duration).2f "%(ip)s" "%(ua)s"', logdata)
+
+    def get_cache_key(self, *args, **kwargs):
+        # Results aren't cached unless a view says how.
+        return None
+
+    def get_request_result(self, api_result):
+        # Views can tailor a result, which may be shared through the
+        # response cache, to the request without changing it.
+        return api_result
+
+class CacheStatsView(BaseAPIView):
+    def get_api_result(self, *args, **kwargs):
+        stats = response_cache.stats()
+        stats['dataset_version'] = get_dataset_version_id()
+        return stats
 
 class StopView(BaseAPIView):
+    max_age = settings.TNM_PREDICTIONS_MAX_AGE
+
     def get_api_result(self, *args, **kwargs):
         try:
             stop = Stop.objects.get(pk=int(kwargs['id']))
         except Stop.DoesNotExist:
             raise Http404
         
-        if not stop.has_predictions:
-            return stop
-
-        jd = stop.json_dict()
-        
-        try:
-            apis = get_apis()
-            logger = logging.getLogger('predictions')
-
-            predictions = {}
-            for prediction in stop.predictions.all():
-                api = apis.get(prediction.api_name, None)
-                if not api:
-                    continue
-
-                api_predictions = api.get_predictions(prediction)
-                for api_prediction in api_predictions:
-                    
-                    logdata = {
-                        'stop_id': stop.id,
-                        'api_name': prediction.api_name,
-                        'api_stop_id': prediction.id,
-                        'stop_name': prediction.name,
-                        'route': api_prediction.route,
-                        'destination': api_prediction.destination,
-                        'wait': api_prediction.wait
-                    }
-                    logger.info('%(stop_id)s %(api_stop_id)s "%(stop_name)s" "%(route)s" "%(destination)s" "%(wait)s"' % logdata) 
-
-                    route_dest_pair = (api_prediction.route, api_prediction.destination)
-                    if route_dest_pair not in predictions:
-                        predictions[route_dest_pair] = []
-                    predictions[route_dest_pair] += [api_prediction.wait]
-           
-            if predictions:
-                jd['predictions'] = [{
-                    'route': k[0],
-                    'destination': k[1],
-                    'waits': v} for (k,v) in predictions.iteritems()]
-                    
-        except Exception as ex:
-            pass
-                
-        return jd
+        return get_stop_predictions([stop])[stop.id]
 
 class LocationAPIView(BaseAPIView):
     params = ['lat', 'lng', 'radius_m']
     required_params = params
+    conditional = True
+    max_age = settings.TNM_DATASET_MAX_AGE
+
+    def get_cache_key(self, *args, **kwargs):
+        if not settings.TNM_RESPONSE_CACHE_MAX_ENTRIES or \
+            not settings.TNM_RESPONSE_CACHE_MAX_BYTES:
+            return None
+
+        # Answer for the center of the grid cell, so that every request in
+        # the cell gets the same result.
+        self.lat, self.lng = snap_to_grid(
+            self.lat, self.lng, settings.TNM_RESPONSE_CACHE_GRID_M)
+
+        return (self.__class__.__name__, get_dataset_version_id(),
+                self.lat, self.lng, self.radius_m)
  
 class NearbyStopsView(LocationAPIView):
+    streaming = settings.TNM_STREAM_STOPS
+
     def get_api_result(self, *args, **kwargs):
-        stops = Stop.objects.filter(location__distance_lte=(
-            Point(self.lng, self.lat, srid=4326),
-            D(m=self.radius_m)))
-        
+        if settings.TNM_STOP_INDEX:
+            stop_ids, distances = get_stop_index().query(
+                self.lat, self.lng, self.radius_m)
+            stops = Stop.objects.filter(id__in=stop_ids.tolist())
+        else:
+            stops = Stop.objects.filter(location__distance_lte=(
+                Point(self.lng, self.lat, srid=4326),
+                D(m=self.radius_m)))
+
+
+        # Read the stops here, while the request's connection is open and
+        # the call is being timed. Only their encoding is streamed.
         return [s.json_dict() for s in stops]
     
 class NearbyView(LocationAPIView):
+    params = LocationAPIView.params + ['zoom']
+    required_params = LocationAPIView.required_params
+
+    # Map zoom level the response will be displayed at, if known, and the
+    # range of zoom levels maps have.
+    zoom = None
+    min_zoom, max_zoom = 0, 22
+
+    # Original query, kept for comparison. Neither distance predicate can use
+    # a spatial index, so every call scans every stop and its services.
+    legacy_query = 'SELECT sfs.id, sfs.stop_id, sfs.route_id, sfss.routesegment_id FROM (SELECT sfs.route_id, sfs.destination_id, min(ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s))) as "mindistance" FROM api_stop INNER JOIN api_servicefromstop sfs ON api_stop.id = sfs.stop_id WHERE ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s)) <= %s AND api_stop.id != sfs.destination_id GROUP BY sfs.route_id, sfs.destination_id) AS closest INNER JOIN api_servicefromstop sfs ON sfs.route_id = closest.route_id AND sfs.destination_id = closest.destination_id INNER JOIN api_stop ON sfs.stop_id = api_stop.id AND ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s)) = closest.mindistance INNER JOIN api_route ON sfs.route_id = api_route.id LEFT OUTER JOIN api_servicefromstop_segments sfss ON sfs.id = sfss.servicefromstop_id'
+
+    # Prefilters stops with ST_DWithin against the geography index created by
+    # builddb, computes each stop's distance once, and ranks the stops for
+    # each route and destination. Ties are kept, as in the original query.
+    query = 'SELECT ranked.id, ranked.stop_id, ranked.route_id, sfss.routesegment_id FROM (SELECT sfs.id, sfs.stop_id, sfs.route_id, rank() OVER (PARTITION BY sfs.route_id, sfs.destination_id ORDER BY nearby.distance) AS distance_rank FROM (SELECT api_stop.id, ST_Distance(geography(api_stop.location), geography(ST_GeomFromEWKB(%s)), false) AS distance FROM api_stop WHERE ST_DWithin(geography(api_stop.location), geography(ST_GeomFromEWKB(%s)), %s, false)) AS nearby INNER JOIN api_servicefromstop sfs ON nearby.id = sfs.stop_id WHERE sfs.stop_id != sfs.destination_id) AS ranked LEFT OUTER JOIN api_servicefromstop_segments sfss ON ranked.id = sfss.servicefromstop_id WHERE ranked.distance_rank = 1'
+
+    def get_service_rows(self, origin, radius, legacy=False):
+        """
+        Returns (service id, stop id, route id, segment id) rows for the
+        closest stop within radius of each route and destination.
+        """
+        if legacy:
+            query = self.legacy_query
+            args = [origin.ewkb, origin.ewkb, radius, origin.ewkb]
+        else:
+            query = self.query
+            args = [origin.ewkb, origin.ewkb, radius]
+
+        cursor = connection.cursor()
+        cursor.execute(query, args)
+        return cursor.fetchall()
+
+    def get_indexed_service_rows(self, radius):
+        """
+        Returns the same rows as get_service_rows, but finds nearby stops
+        using the in-memory stop index so that the database is only asked
+        for the services and segments of those stops.
+        """
+        rows = get_indexed_service_rows([(0, self.lat, self.lng, radius)])
+        return [row[1:] for row in rows]
+
+    # Clients may list the ids of objects they already have in these
+    # parameters, to get a response that leaves those objects out. Since
+    # the lists can get long, clients POST them instead of adding them to
+    # the query string.
+    known_params = {
+        'stops': 'known_stops',
+        'routes': 'known_routes',
+        'segments': 'known_segments'
+    }
+
+    def get_known_ids(self):
+        """
+        Returns a dictionary of sets of ids the client already has, or None
+        if the request didn't list any.
+        """
+        params = self.request.REQUEST
+        if not any(params.get(param) for param in self.known_params.values()):
+            return None
+
+        known = {}
+        for key, param in self.known_params.iteritems():
+            try:
+                known[key] = set(int(i) for i in params.get(param, '').split(',') if i)
+            except ValueError:
+                known[key] = set()
+        return known
+
+    def get_tolerance(self):
+        """
+        Returns the largest segment simplification tolerance that is smaller
+        than a pixel at the requested zoom level, or None for full resolution.
+        """
+        if self.zoom is None:
+            return None
+
+        # Degrees of longitude per pixel in 256 pixel map tiles.
+        zoom = min(max(self.zoom, self.min_zoom), self.max_zoom)
+        pixel = 360.0 / (256 * 2 ** zoom)
+        tolerances = [t for t in settings.TNM_SEGMENT_TOLERANCES if t <= pixel]
+        if not tolerances:
+            return None
+        return max(tolerances)
+
+    def post(self, request, *args, **kwargs):
+        # The location is still in the query string, but the response
+        # depends on the body too, so it can't be validated by ETag.
+        self.conditional = False
+        return self.get(request, *args, **kwargs)
+
+    def get_cache_key(self, *args, **kwargs):
+        # The full result is cached, and known objects are left out of it
+        # for each request.
+        key = super(NearbyView, self).get_cache_key(*args, **kwargs)
+        if key is not None:
+            key += (self.get_tolerance(),)
+        return key
+
     def get_api_result(self, *args, **kwargs):
         origin = Point(self.lng, self.lat, srid=4326)
         radius = self.radius_m
        
-        services = []
-        stops = []
-        routes = []
-        routesegments = []
-
         # First see if there is any service anywhere near this point.
-        nearby_stops = Stop.objects.filter(location__distance_lte=(
-            origin,
-            D(mi=settings.TNM_COVERAGE_AREA_DISTANCE_THRESHOLD_IN_MILES)))
-        coverage = (0 < len(nearby_stops))
+        coverage = get_coverage([(self.lat, self.lng)])[0]
 
         # If there's something nearby, do a more specific query.
         if coverage:
+            if settings.TNM_STOP_INDEX:
+                data = self.get_indexed_service_rows(radius)
+            else:
+                data = self.get_service_rows(origin, radius)
+        else:
+            data = []
 
-            query = 'SELECT sfs.id, sfs.stop_id, sfs.route_id, sfss.routesegment_id FROM (SELECT sfs.route_id, sfs.destination_id, min(ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s))) as "mindistance" FROM api_stop INNER JOIN api_servicefromstop sfs ON api_stop.id = sfs.stop_id WHERE ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s)) <= %s AND api_stop.id != sfs.destination_id GROUP BY sfs.route_id, sfs.destination_id) AS closest INNER JOIN api_servicefromstop sfs ON sfs.route_id = closest.route_id AND sfs.destination_id = closest.destination_id INNER JOIN api_stop ON sfs.stop_id = api_stop.id AND ST_Distance_Sphere(api_stop.location, ST_GeomFromEWKB(%s)) = closest.mindistance INNER JOIN api_route ON sfs.route_id = api_route.id LEFT OUTER JOIN api_servicefromstop_segments sfss ON sfs.id = sfss.servicefromstop_id'
-            args = [origin.ewkb, origin.ewkb, radius, origin.ewkb]
+        result = serialize_nearby(data, tolerance=self.get_tolerance())
+        result['coverage'] = coverage
+        return result
+
+    def get_request_result(self, api_result):
+        known = self.get_known_ids()
+        if known is None:
+            return api_result
+        return omit_known(api_result, known)
+
+class NearbyBatchView(BaseAPIView):
+    """
+    Answers nearby queries for many points in one request.
 
-            cursor = connection.cursor()
-            cursor.execute(query, args)
-            data = cursor.fetchall()
-
-            servicefromstop_ids = [row[0] for row in data]
-            stop_ids = [row[1] for row in data]
-            route_ids = [row[2] for row in data]
-            routesegment_ids = [row[3] for row in data]
-
-            services = ServiceFromStop.objects.filter(id__in=servicefromstop_ids)
-            stops = Stop.objects.filter(id__in=stop_ids)
-            routes = Route.objects.filter(id__in=route_ids)
-            routesegments = RouteSegment.objects.filter(id__in=routesegment_ids)
-
-        return {
-            'coverage': coverage,
-            'services': services,
-            'stops': stops,
-            'routes': routes,
-            'segments': routesegments
+    Clients POST a JSON body of the form:
+
+        {
+            "points": [
+                {"lat": 38.8951, "lng": -77.0363, "radius_m": 800},
+                ...
+            ]
         }
+
+    The response contains one entry in "results" per point, in order, each
+    listing the ids of the services near that point. The services, stops,
+    routes and segments they refer to are listed once for the whole batch.
+
+    """
+    http_method_names = ['post']
+
+    # Same as NearbyView.query, but for a list of points and radii given as
+    # a VALUES list, ranking stops separately for each point.
+    query = 'SELECT ranked.point_index, ranked.id, ranked.stop_id, ranked.route_id, sfss.routesegment_id FROM (SELECT nearby.point_index, sfs.id, sfs.stop_id, sfs.route_id, rank() OVER (PARTITION BY nearby.point_index, sfs.route_id, sfs.destination_id ORDER BY nearby.distance) AS distance_rank FROM (SELECT points.point_index, api_stop.id, ST_Distance(geography(api_stop.location), geography(points.location), false) AS distance FROM (VALUES %(values)s) AS points(point_index, location, radius) INNER JOIN api_stop ON ST_DWithin(geography(api_stop.location), geography(points.location), points.radius, false)) AS nearby INNER JOIN api_servicefromstop sfs ON nearby.id = sfs.stop_id WHERE sfs.stop_id != sfs.destination_id) AS ranked LEFT OUTER JOIN api_servicefromstop_segments sfss ON ranked.id = sfss.servicefromstop_id WHERE ranked.distance_rank = 1'
+    value = '(%s, ST_GeomFromEWKB(%s), %s::float8)'
+
+    def post(self, request, *args, **kwargs):
+        try:
+            points = json.loads(request.raw_post_data)['points']
+            points = [(float(p['lat']), float(p['lng']), float(p['radius_m']))
+                      for p in points]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest('Expected JSON body: {"points": [{"lat": ..., "lng": ..., "radius_m": ...}, ...]}')
+
+        if len(points) > settings.TNM_NEARBY_BATCH_MAX_POINTS:
+            return HttpResponseBadRequest('At most %s points are allowed' % settings.TNM_NEARBY_BATCH_MAX_POINTS)
+
+        start = time.time()
+        api_result = self.get_batch_result(points)
+        duration = time.time() - start
+
+        self.log_call(request, '%s points' % len(points), duration)
+
+        return self.render_to_response(api_result)
+
+    def get_service_rows(self, points):
+        """
+        Returns (point index, service id, stop id, route id, segment id) rows
+        for each of the given (point index, lat, lng, radius) tuples.
+        """
+        if not points:
+            return []
+
+        values = []
+        args = []
+        for point_index, lat, lng, radius in points:
+            values.append(self.value)
+            args.extend([point_index, Point(lng, lat, srid=4326).ewkb, radius])
+
+        query = self.query % {'values': ', '.join(values)}
+
+        cursor = connection.cursor()
+        cursor.execute(query, args)
+        return cursor.fetchall()
+
+    def get_batch_result(self, points):
+        results = []
+        covered = []
+        coverage = get_coverage([(lat, lng) for lat, lng, radius in points])
+        for point_index, (lat, lng, radius) in enumerate(points):
+            results.append({'coverage': coverage[point_index], 'services': []})
+            if coverage[point_index]:
+                covered.append((point_index, lat, lng, radius))
+
+        if settings.TNM_STOP_INDEX:
+            data = get_indexed_service_rows(covered)
+        else:
+            data = self.get_service_rows(covered)
+        for row in data:
+            services = results[row[0]]['services']
+            if row[1] not in services:
+                services.append(row[1])
+
+        result = serialize_nearby([row[1:] for row in data])
+        result['results'] = results
+        return result
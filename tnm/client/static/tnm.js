@@ -12,6 +12,8 @@ $(function() {
                 'url': tnm_tile_server.url,
                 'subdomains': tnm_tile_server.subdomains,
                 'max_zoom': tnm_tile_server.max_zoom,
+                'prediction_stream_url': tnm_predictions.stream_url,
+                'prediction_poll_seconds': tnm_predictions.poll_seconds,
                 'lat': initialLat, 
                 'lng': initialLng, 
                 'radius': getRadius() });
@@ -26,7 +28,13 @@ $(function() {
     map.addCallback({
         types: ['center'],
         apiCall: Transit.API.getNearby,
-        extraParams: { 'radius_m': getRadius },
+        extraParams: {
+            'radius_m': getRadius,
+            'known_stops': function() { return map.knownIds('stops'); },
+            'known_routes': function() { return map.knownIds('routes'); },
+            'known_segments': function() { return map.knownIds('segments'); },
+            'zoom': function() { return map.zoom(); }
+        },
         before: function(e) {
             map.radius(e.latlng, getRadius());
             map.overlay('nearby');
@@ -57,7 +65,12 @@ $(function() {
                 });
             } else {
                 map.radius(e.latlng, getRadius());
-                map.overlay('nearby', data);
+                if (!map.overlay('nearby', data)) {
+                    // Objects this response left out have since been
+                    // dropped from the cache, so ask for them again.
+                    map.center(e.latlng);
+                    return;
+                }
                 $(window).resize();
                 $.mobile.hidePageLoadingMsg();
                 
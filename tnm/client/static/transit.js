@@ -92,23 +92,41 @@ Transit.decodePolyline = function(polyline) {
 
 // API calls.
 Transit.API = {
-    _call: function(urlTmpl) {
+    // Parameters named in bodyParams can get too long for a query string,
+    // so they are POSTed instead when any of them is given.
+    _call: function(urlTmpl, bodyParams) {
         return function(params, callback) {
-            var url = urlTmpl, d;
+            var url = urlTmpl, body = {}, d;
             for (i in params) {
                 if ($.isFunction(params[i])) {
                     params[i] = params[i]();
                 }
+                if (bodyParams && $.inArray(i, bodyParams) != -1) {
+                    if (params[i]) {
+                        body[i] = params[i];
+                    }
+                    continue;
+                }
                 url = url.replace(RegExp('\\{'+i+'\\}', 'gi'), params[i]);
             }
-            d = $.getJSON(url);
+            // Leave out parameters that weren't given.
+            url = url.replace(/\{\w+\}/g, '');
+            if ($.isEmptyObject(body)) {
+                d = $.getJSON(url);
+            } else {
+                d = $.post(url, body, null, 'json');
+            }
             callback && d.success(callback);
         };
     }
 };
 
 Transit.API.getNearby = Transit.API._call(
-    '/api/nearby?lng={lng}&lat={lat}&radius_m={radius_m}');
+    '/api/nearby?lng={lng}&lat={lat}&radius_m={radius_m}&zoom={zoom}',
+    ['known_stops', 'known_routes', 'known_segments']);
+
+// Most objects of each type to remember between nearby calls.
+Transit.maxCachedObjects = 500;
 
 // Leaflet Map wrapper.
 Transit._leafletMap = function(element, options) {
@@ -127,12 +145,18 @@ Transit._leafletMap = function(element, options) {
         
     this.layers = { 'tiles': tiles };
     this.hiddenLayers = {};
+
+    // Stops following the predictions of the stop whose popup is open.
+    this.stopPredictions = null;
        
     this.segments = {};
     this.stops = {};
     this.routes = {};
     this.services = {};
 
+    // Objects received from earlier nearby calls, by type and id.
+    this.cache = { 'stops': {}, 'routes': {}, 'segments': {} };
+
     this.map = map;
     this.map._wrapper = this; 
 
@@ -144,41 +168,66 @@ Transit._leafletMap = function(element, options) {
         });
     }
 
+    // Calls callback with the predictions of a stop now and whenever they
+    // change, from the prediction stream if there is one or else by polling,
+    // until the returned function is called.
+    function followPredictions(stopId, callback) {
+        var source, timer, poll;
+
+        if (options.prediction_stream_url && window.EventSource) {
+            source = new EventSource(options.prediction_stream_url + '?stops=' + stopId);
+            source.addEventListener('predictions', function(event) {
+                callback($.parseJSON(event.data));
+            }, false);
+            return function() { source.close(); };
+        }
+
+        poll = function() { $.getJSON('/api/stop/' + stopId, callback); };
+        poll();
+        timer = setInterval(poll, 1000 * (options.prediction_poll_seconds || 30));
+        return function() { clearInterval(timer); };
+    }
+
+    function showPredictions(popup, data) {
+        var i, j, prediction, predictions_str;
+
+        if (!popup || !data.predictions) {
+            return;
+        }
+
+        predictions_str = '<div class="tnm-stop-predictions"><h2>Wait times</h2>';
+        predictions_str += '<ul class="tnm-stop-prediction-list">';
+        for (i in data.predictions) {
+            prediction = data.predictions[i];
+            predictions_str += '<li>';
+            predictions_str += '<div class="tnm-stop-prediction-route">' + prediction.route + ' ' + prediction.destination + '</div>';
+            predictions_str += '<div class="tnm-stop-prediction-waits"><ul>';
+            for (j in prediction.waits) {
+                predictions_str += '<li>' + prediction.waits[j] + '</li>';
+            }
+            predictions_str += '</ul></div></li>';
+        }
+        predictions_str += '</ul></div>';
+
+        // Replace the wait times shown before, if any.
+        $(popup._contentNode).find('.tnm-stop-predictions').remove();
+        $(popup._contentNode).append(predictions_str);
+    }
+
     map.on('popupopen', function(e) {
         var src = e.popup._source,
             visibleLayers = {},
             hiddenLayers = [],
-            i, j, layer, stop, service, segment, 
-            prediction, predictions_str;
+            i, j, layer, stop, service, segment;
    
         if (!src._overlayID) {
             return;
         }
  
         if (src.stop) {
-            $.getJSON('/api/stop/' + src.stop.id, function(data) {
-                if (data.predictions) {
-                    if (e.popup) {
-                        predictions_str = '<h2>Wait times</h2>'
-                        predictions_str += '<ul class="tnm-stop-prediction-list">';
-                        for (i in data.predictions) {
-                            prediction = data.predictions[i];
-                            predictions_str += '<li>';
-                            predictions_str += '<div class="tnm-stop-prediction-route">' + prediction.route + ' ' + prediction.destination + '</div>';
-                            predictions_str += '<div class="tnm-stop-prediction-waits"><ul>';
-                            for (j in prediction.waits) {
-                                predictions_str += '<li>' + prediction.waits[j] + '</li>';
-                            }
-                            predictions_str += '</ul></div></li>';
-                        }
-
-                        if (!data.predictions) {
-                            predictions_str += '<li>Wait times unavailable.</li>'
-                        }
-                        predictions_str += '</ul>';
-                        $(e.popup._contentNode).append(predictions_str);
-                    }
-                }
+            this._wrapper.stopPredictions && this._wrapper.stopPredictions();
+            this._wrapper.stopPredictions = followPredictions(src.stop.id, function(data) {
+                showPredictions(e.popup, data);
             });
 
             visibleLayers[src.stop.layer._leaflet_id] = src.stop.layer;
@@ -225,6 +274,11 @@ Transit._leafletMap = function(element, options) {
             return;
         }
 
+        if (this._wrapper.stopPredictions) {
+            this._wrapper.stopPredictions();
+            this._wrapper.stopPredictions = null;
+        }
+
         hiddenLayers = this._wrapper.hiddenLayers[src._overlayID];
         for (i in hiddenLayers) {
             this.addLayer(hiddenLayers[i]);
@@ -262,6 +316,9 @@ Transit._leafletMap.prototype.addCallback = function(options) {
     }
 };
 
+// Shows the objects of a nearby response, or removes the overlay if none is
+// given. Returns false, leaving the overlay empty, if the response refers to
+// objects that are no longer cached; call the API again to get them.
 Transit._leafletMap.prototype.overlay = function(overlayID, overlay) {
     var oldLayer = this.layers[overlayID],
         layers = new L.LayerGroup(),
@@ -271,32 +328,70 @@ Transit._leafletMap.prototype.overlay = function(overlayID, overlay) {
     delete this.layers[overlayID];
    
     if (!overlay) {
-        return;
+        return true;
     }
 
-    this.stops = {};
-    this.routes = {};
-    this.segments = {};
-    this.services = {};
-
-    // Update map containers with new data.
+    // Remember new objects. The server leaves out objects that were
+    // listed as already known, so later calls can refer to these.
     for (i in overlay.stops) {
         stop = overlay.stops[i];
-        stop.services = {};
-        this.stops[stop.id] = stop;
+        this.cache.stops[stop.id] = stop;
     }
 
     for (i in overlay.routes) {
         route = overlay.routes[i];
-        this.routes[route.id] = route;
+        this.cache.routes[route.id] = route;
     }
 
     for (i in overlay.segments) {
         segment = overlay.segments[i];
         segment.line = Transit.decodePolyline(segment.line_encoded);
-        segment.services = {};
-        segment.destinations = {};
-        this.segments[segment.id] = segment;
+        this.cache.segments[segment.id] = segment;
+    }
+
+    // Objects that were known when the request was sent may have been
+    // dropped from the cache since, by a response to an overlapping call.
+    // They aren't known anymore, so the caller can ask again to get them.
+    for (i in overlay.services) {
+        service = overlay.services[i];
+
+        if (!(service.stop in this.cache.stops) || !(service.route in this.cache.routes)) {
+            return false;
+        }
+        for (j in service.segments) {
+            if (!(service.segments[j] in this.cache.segments)) {
+                return false;
+            }
+        }
+    }
+
+    this.stops = {};
+    this.routes = {};
+    this.segments = {};
+    this.services = {};
+
+    // Update map containers with the objects used by this overlay.
+    for (i in overlay.services) {
+        service = overlay.services[i];
+
+        if (!(service.stop in this.stops)) {
+            stop = this.cache.stops[service.stop];
+            stop.services = {};
+            this.stops[stop.id] = stop;
+        }
+
+        if (!(service.route in this.routes)) {
+            this.routes[service.route] = this.cache.routes[service.route];
+        }
+
+        for (j in service.segments) {
+            if (!(service.segments[j] in this.segments)) {
+                segment = this.cache.segments[service.segments[j]];
+                segment.services = {};
+                segment.destinations = {};
+                this.segments[segment.id] = segment;
+            }
+        }
     }
 
     for (i in overlay.services) {
@@ -399,10 +494,44 @@ Transit._leafletMap.prototype.overlay = function(overlayID, overlay) {
         layers.addLayer(stop_marker);
     }
 
+    // Rather than sending an ever growing list of known ids, only keep
+    // the objects on the map once the cache gets too big.
+    for (i in this.cache) {
+        num = 0;
+        for (j in this.cache[i]) {
+            num++;
+        }
+        if (num > Transit.maxCachedObjects) {
+            this.cache[i] = $.extend({}, this[i]);
+        }
+    }
+
     oldLayer && this.map.removeLayer(oldLayer);
     this.layers[overlayID] = layers;
     this.hiddenLayers[overlayID] = [];
     this.map.addLayer(layers);
+    return true;
+}
+
+Transit._leafletMap.prototype.knownIds = function(type) {
+    var ids = [],
+        id;
+
+    // Segment lines are simplified for the zoom level they were requested
+    // at, so forget them when the zoom level changes.
+    if (type == 'segments' && this.cacheZoom != this.map.getZoom()) {
+        this.cache.segments = {};
+        this.cacheZoom = this.map.getZoom();
+    }
+
+    for (id in this.cache[type]) {
+        ids.push(id);
+    }
+    return ids.join(',');
+}
+
+Transit._leafletMap.prototype.zoom = function() {
+    return this.map.getZoom();
 }
 
 Transit._leafletMap.prototype.radius = function(latlng, radius_m) {
@@ -8,7 +8,9 @@ urlpatterns = patterns('',
         'template': 'client/leaflet.html',
         'extra_context': { 
             'tile_server': settings.TILE_SERVER,
-			'geocoder_key': settings.TNM_GEOCODER_KEY
+			'geocoder_key': settings.TNM_GEOCODER_KEY,
+            'prediction_stream_url': settings.TNM_PREDICTION_STREAM_URL,
+            'predictions_max_age': settings.TNM_PREDICTIONS_MAX_AGE
         }   
     }),
 )
@@ -88,6 +88,10 @@ LOGGING = {
 		'simple': {
 			'format': '%(levelname)s %(asctime)s %(message)s'
 		},
+		# Use this formatter for one JSON object per line instead.
+		'jsonlines': {
+			'()': 'api.handlers.JSONLinesFormatter',
+		},
 	},
     'handlers': {
         'mail_admins': {
@@ -96,15 +100,15 @@ LOGGING = {
         },
 		'api': {
 			'level': 'DEBUG',
-			'class': 'logging.FileHandler',
+			'class': 'api.handlers.BatchedFileHandler',
 			'formatter': 'simple',
-			'filename': path(SITE_ROOT, os.path.join('log', 'api.log'))
+			'filename': path(SITE_ROOT, os.path.join('log', 'api.log')),
 		},
         'predictions': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'api.handlers.BatchedFileHandler',
             'formatter': 'simple',
-            'filename': path(SITE_ROOT, os.path.join('log', 'predictions.log'))
+            'filename': path(SITE_ROOT, os.path.join('log', 'predictions.log')),
         },
     },
     'loggers': {
@@ -149,5 +153,130 @@ PIPELINE_JS = {
     },
 }
 
+# Transit Near Me defaults. Override these in local_settings.py.
+
+# Answer nearby queries from an in-memory index of stop locations loaded at
+# worker startup, instead of computing distances in PostGIS. Requires NumPy.
+TNM_STOP_INDEX = False
+
+# Size of the cells of the coverage raster computed by builddb. Rerun
+# builddb after changing this.
+TNM_COVERAGE_CELL_SIZE_IN_DEGREES = 0.05
+
+# Cache nearby results for locations snapped to a grid of this many meters,
+# keeping at most this many results, of about this many bytes of JSON in
+# all, per worker. Results take a few times their JSON size in memory. Set
+# either limit to 0 to disable.
+TNM_RESPONSE_CACHE_GRID_M = 25
+TNM_RESPONSE_CACHE_MAX_ENTRIES = 10000
+TNM_RESPONSE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# How often workers check whether builddb has produced a new dataset.
+TNM_DATASET_VERSION_CHECK_SECONDS = 10
+
+# Seconds browsers and proxies may reuse nearby results, which only change
+# when builddb runs, and predictions, which providers refresh about this often.
+TNM_DATASET_MAX_AGE = 300
+TNM_PREDICTIONS_MAX_AGE = 30
+
+# Largest number of points accepted by a single /api/nearby/batch request.
+TNM_NEARBY_BATCH_MAX_POINTS = 100
+
+# Douglas-Peucker tolerances, in degrees, of the simplified segment
+# polylines computed by builddb. Nearby requests that give a map zoom level
+# get the coarsest polylines that are still accurate to about a pixel.
+TNM_SEGMENT_TOLERANCES = (0.00005, 0.0002, 0.0008)
+
+# Stream /api/stops results to the client one stop at a time as they are
+# encoded. The stops themselves are read before the response starts.
+TNM_STREAM_STOPS = False
+
+# Open stop popups refresh their predictions every TNM_PREDICTIONS_MAX_AGE
+# seconds from /api/stop. If TNM_PREDICTION_STREAM_URL is set, browsers with
+# server-sent events follow it instead. It must lead to the /stream path of
+# the prediction gateway, which keeps a thread rather than a worker per
+# stream, for example with nginx:
+#
+#   location /api/predictions/stream {
+#       proxy_pass http://127.0.0.1:8081/stream;
+#       proxy_buffering off;
+#   }
+#
+# The gateway gets the predictions of watched stops from the function named
+# by TNM_PREDICTION_STREAM_SOURCE every TNM_PREDICTION_STREAM_INTERVAL
+# seconds. Streams end after TNM_PREDICTION_STREAM_MAX_DURATION seconds, when
+# browsers reconnect, and get a comment every TNM_PREDICTION_STREAM_KEEPALIVE
+# seconds when idle.
+TNM_PREDICTION_STREAM_URL = None
+TNM_PREDICTION_STREAM_SOURCE = 'api.predictions.render_stop_predictions'
+TNM_PREDICTION_STREAM_INTERVAL = 30
+TNM_PREDICTION_STREAM_MAX_DURATION = 300
+TNM_PREDICTION_STREAM_KEEPALIVE = 15
+TNM_PREDICTION_STREAM_MAX_STOPS = 20
+
+# Number of threads per worker for calling transit APIs, and how many
+# seconds a request waits for predictions before answering without them.
+TRANSIT_APIS_THREADS = 8
+TRANSIT_APIS_TIMEOUT = 5
+
+# Cache predictions for TRANSIT_APIS_CACHE_TTL seconds, and serve them for up
+# to TRANSIT_APIS_CACHE_STALE_TTL more seconds while refreshing them. The
+# backend is 'local' for a cache in each worker, the name of a cache in
+# CACHES (such as memcached) to share predictions between workers, or None
+# to disable caching.
+TRANSIT_APIS_CACHE_BACKEND = 'local'
+TRANSIT_APIS_CACHE_TTL = 30
+TRANSIT_APIS_CACHE_STALE_TTL = 60
+
+# Longest time to keep predictions whose API says when they expire, such as
+# Connexionz. Predictions from other APIs are kept for TRANSIT_APIS_CACHE_TTL.
+TRANSIT_APIS_CACHE_MAX_TTL = 300
+TRANSIT_APIS_CACHE_MAX_ENTRIES = 10000
+
+# Seconds to remember that an API failed for a stop. Meanwhile, callers
+# waiting for the same stop and new callers report the failure instead of
+# asking the API again.
+TRANSIT_APIS_CACHE_ERROR_TTL = 5
+
+# Seconds to wait for transit API hosts to connect and to send data, how many
+# idle keep-alive connections to keep per host, and whether to ask for gzip.
+TRANSIT_APIS_CONNECT_TIMEOUT = 3
+TRANSIT_APIS_READ_TIMEOUT = 10
+TRANSIT_APIS_MAX_IDLE_CONNECTIONS = 4
+TRANSIT_APIS_GZIP = True
+
+# Stop calling a transit API for TRANSIT_APIS_BREAKER_BACKOFF seconds, doubling
+# up to TRANSIT_APIS_BREAKER_MAX_BACKOFF while it keeps failing, when at least
+# TRANSIT_APIS_BREAKER_MIN_FAILURES of its last TRANSIT_APIS_BREAKER_WINDOW
+# calls, and at least TRANSIT_APIS_BREAKER_ERROR_RATE of them, failed or took
+# longer than TRANSIT_APIS_TIMEOUT.
+TRANSIT_APIS_BREAKER_WINDOW = 20
+TRANSIT_APIS_BREAKER_MIN_FAILURES = 5
+TRANSIT_APIS_BREAKER_ERROR_RATE = 0.5
+TRANSIT_APIS_BREAKER_BACKOFF = 5
+TRANSIT_APIS_BREAKER_MAX_BACKOFF = 300
+
+# Read timeouts are this multiple of each API's 95th percentile latency, but
+# at least TRANSIT_APIS_MIN_READ_TIMEOUT and at most TRANSIT_APIS_READ_TIMEOUT.
+TRANSIT_APIS_TIMEOUT_P95_MULTIPLIER = 3
+TRANSIT_APIS_MIN_READ_TIMEOUT = 1
+
+# Keep a history of predictions in monthly tables inheriting from
+# transitapis_recordedprediction. Up to TRANSIT_APIS_RECORDER_MAX_BUFFERED
+# predictions wait in memory per worker and are copied to the database every
+# TRANSIT_APIS_RECORDER_INTERVAL seconds, or once TRANSIT_APIS_RECORDER_BATCH_SIZE
+# are waiting. When the buffer is full, 'drop_newest' drops new predictions
+# and 'drop_oldest' drops the oldest buffered ones.
+TRANSIT_APIS_RECORDER = False
+TRANSIT_APIS_RECORDER_MAX_BUFFERED = 50000
+TRANSIT_APIS_RECORDER_BATCH_SIZE = 5000
+TRANSIT_APIS_RECORDER_INTERVAL = 10
+TRANSIT_APIS_RECORDER_POLICY = 'drop_newest'
+
+# URL of a prediction gateway started with manage.py predictiongateway, such
+# as 'http://127.0.0.1:8081', to get predictions from it instead of calling
+# transit APIs from each worker. None calls them from each worker.
+TRANSIT_APIS_GATEWAY = None
+
 # Import local settings. This is required.
 from local_settings import *
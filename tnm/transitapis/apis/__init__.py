@@ -1,5 +1,78 @@
+import threading
+
 from django.conf import settings
 
+class Registry(object):
+    """
+    Read-only dictionary of transit APIs by name, which imports and creates
+    each API the first time it is looked up.
+    """
+    def __init__(self, api_settings):
+        self.api_settings = api_settings
+        self.apis = {}
+        self.lock = threading.Lock()
+
+    def create(self, api_name):
+        api_tuple = self.api_settings[api_name]
+        api_cls = api_tuple[0]
+        api_options = {}
+        if len(api_tuple) > 1:
+            api_options = api_tuple[1]
+
+        cls_parts = api_cls.split('.')
+        cls = __import__('.'.join(cls_parts[:-1]))
+        for cls_part in cls_parts[1:]:
+            cls = getattr(cls, cls_part)
+
+        return cls(name=api_name, options=api_options)
+
+    def __getitem__(self, api_name):
+        api = self.apis.get(api_name, None)
+        if api is None:
+            with self.lock:
+                api = self.apis.get(api_name, None)
+                if api is None:
+                    api = self.create(api_name)
+                    self.apis[api_name] = api
+        return api
+
+    def __contains__(self, api_name):
+        return api_name in self.api_settings
+
+    def __iter__(self):
+        return iter(self.api_settings)
+
+    def __len__(self):
+        return len(self.api_settings)
+
+    def get(self, api_name, default=None):
+        if api_name not in self.api_settings:
+            return default
+        return self[api_name]
+
+    def keys(self):
+        return self.api_settings.keys()
+
+    def values(self):
+        return [self[api_name] for api_name in self.api_settings]
+
+    def items(self):
+        return [(api_name, self[api_name]) for api_name in self.api_settings]
+
+    iteritems = items
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def configure_apis(api_settings):
+    """
+    Replaces the process-wide APIs with ones created from the given
+    settings, which have the same form as settings.TRANSIT_APIS.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = Registry(api_settings)
+
 def get_apis():
     """
     Returns a dictionary of transit APIs as specified in the project settings.
@@ -27,23 +100,14 @@ def get_apis():
     Different API classes require different options to be passed in at
     creation time. Consult individual class documentation for details.
 
-    """
-    api_settings = settings.TRANSIT_APIS
-    
-    apis = {}
-    for api_name, api_tuple in api_settings.iteritems():
-        api_cls = api_tuple[0]
-        api_options = {}
-        if len(api_tuple) > 1:
-            api_options = api_tuple[1]
+    The dictionary is created once per process, and each API object is
+    created the first time it is used, so API objects can keep state such
+    as connections, caches or rate limits between requests.
 
-        cls_parts = api_cls.split('.')
-        cls = __import__('.'.join(cls_parts[:-1]))
-        for cls_part in cls_parts[1:]:
-            cls = getattr(cls, cls_part)
-
-        api = cls(name=api_name, options=api_options)
-        apis[api_name] = api
-    
-    return apis
-        
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = Registry(settings.TRANSIT_APIS)
+    return _registry
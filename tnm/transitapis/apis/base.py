@@ -1,9 +1,27 @@
 import abc
 
+from transitapis.apis.transport import get_transport
+from transitapis.health import get_health
+
+class Results(list):
+    """
+    List of stops or predictions returned by an API, with the time, in
+    seconds since the epoch, until which the API says it is valid. expires
+    is None if the API doesn't say.
+    """
+    def __init__(self, items=(), expires=None):
+        list.__init__(self, items)
+        self.expires = expires
+
 class Base(object):
     __metaclass__ = abc.ABCMeta
     required_options = []
 
+    # Most stops that get_predictions_many can answer with one request.
+    # APIs that can only get one stop at a time leave this at 1, so that
+    # their stops are requested in parallel instead.
+    max_batch_size = 1
+
     def __init__(self, name, options={}):
         self.name = name
         self.options = options
@@ -11,10 +29,36 @@ class Base(object):
             if not option in self.options:
                 raise ValueError, 'Missing configuration option: %s' % option
 
+    def fetch(self, url):
+        """
+        Gets a URL with the shared transport and returns the response body
+        as a file-like object. Raises transport.HTTPError or socket errors.
+
+        The read timeout adapts to how fast the API has been answering.
+        """
+        return get_transport().fetch(
+            url, self.name, timeout=get_health(self.name).get_timeout())
+
     @abc.abstractmethod
     def get_all_stops(self):    
+        """
+        Returns a list of all stops. APIs that know how long the list stays
+        valid return it as Results with expires set.
+        """
         pass
 
     @abc.abstractmethod
     def get_predictions(self, stop):
+        """
+        Returns a list of predictions for a stop. APIs that know how long the
+        predictions stay valid return them as Results with expires set.
+        """
         pass
+
+    def get_predictions_many(self, stops):
+        """
+        Returns a list of predictions for each of the given stops, in the
+        same order. APIs that can get predictions for several stops in one
+        request override this.
+        """
+        return [self.get_predictions(stop) for stop in stops]
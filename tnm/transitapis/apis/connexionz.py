@@ -1,11 +1,37 @@
 import abc
-import urllib2
+import calendar
+import re
+import time
 
 from datetime import datetime
 from django.contrib.gis.geos import Point
-from transitapis.apis.base import Base
+from transitapis.apis.base import Base, Results
+from transitapis.apis.xmlstream import children, iterelements
 from transitapis.models import Stop, Prediction
-from xml.dom import minidom
+
+expires_re = re.compile(
+    r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+
+def parse_expires(value):
+    """
+    Converts an Expires time like 2011-12-14T14:54:01-05:00 to seconds since
+    the epoch. Times without an offset are taken to be local. Returns None
+    if the value can't be parsed.
+    """
+    match = expires_re.match(value or '')
+    if not match:
+        return None
+
+    timestamp, utc, sign, hours, minutes = match.groups()
+    parsed = time.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+    if utc:
+        return calendar.timegm(parsed)
+    if sign:
+        offset = 60 * (60 * int(hours) + int(minutes))
+        if sign == '+':
+            offset = -offset
+        return calendar.timegm(parsed) + offset
+    return time.mktime(parsed)
 
 class Connexionz(Base):
     """
@@ -45,6 +71,10 @@ class Connexionz(Base):
           </Platform>
         </RoutePositionET>
 
+    Both documents have a Content element whose Expires attribute says how
+    long they stay valid. Stops and predictions are returned with that time
+    as their expiry, so that they aren't requested again before then.
+
     """
     required_options = ['url']
     base_path = '/rtt/public/utility/file.aspx?contenttype=SQLXML'
@@ -54,24 +84,23 @@ class Connexionz(Base):
             self.options['url'],
             self.base_path)
 
-        try:
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        response = self.fetch(url)
 
-        dom = minidom.parse(response)
+        stops = Results()
+        for elem_name, platform_elem, ancestors in iterelements(response, ['Content', 'Platform']):
+            if elem_name == 'Content':
+                stops.expires = parse_expires(platform_elem.get('Expires'))
+                continue
 
-        stops = []
-        for platform_elem in dom.getElementsByTagName('Platform'):
-            tag = platform_elem.getAttribute('PlatformTag')
-            name = platform_elem.getAttribute('Name')
+            tag = platform_elem.get('PlatformTag')
+            name = platform_elem.get('Name')
             
-            position_elems = platform_elem.getElementsByTagName('Position')
+            position_elems = children(platform_elem, 'Position')
             if 1 != len(position_elems):
                 continue
 
-            lat = position_elems[0].getAttribute('Lat')
-            lon = position_elems[0].getAttribute('Long')
+            lat = position_elems[0].get('Lat')
+            lon = position_elems[0].get('Long')
 
             if tag and name and lat and lon:
                 stops.append(Stop(
@@ -91,27 +120,26 @@ class Connexionz(Base):
             self.base_path,
             stop.api_data)
 
-        try:
-            query_time = datetime.now()
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        query_time = datetime.now()
+        response = self.fetch(url)
 
-        dom = minidom.parse(response)
+        predictions = Results()
+        for elem_name, route_elem, ancestors in iterelements(response, ['Content', 'Route']):
+            if elem_name == 'Content':
+                predictions.expires = parse_expires(route_elem.get('Expires'))
+                continue
 
-        predictions = []
-        for route_elem in dom.getElementsByTagName('Route'):
-            route = route_elem.getAttribute('RouteNo')
+            route = route_elem.get('RouteNo')
             
-            destination_elems = route_elem.getElementsByTagName('Destination')
+            destination_elems = children(route_elem, 'Destination')
             if 1 != len(destination_elems):
                 continue
             
-            destination = destination_elems[0].getAttribute('Name')
+            destination = destination_elems[0].get('Name')
 
-            trip_elems = destination_elems[0].getElementsByTagName('Trip')
+            trip_elems = children(destination_elems[0], 'Trip')
             for trip_elem in trip_elems:
-                eta = trip_elem.getAttribute('ETA')
+                eta = trip_elem.get('ETA')
 
                 if route and destination and eta:
                     predictions.append(Prediction(
@@ -0,0 +1,60 @@
+import random
+import time
+
+from datetime import datetime
+from transitapis.apis.base import Base
+from transitapis.models import Prediction
+
+class Fake(Base):
+    """
+    API that makes up predictions, for trying out the prediction pipeline
+    without calling real transit APIs.
+
+    It has no stops of its own, so use it under the name of a real API
+    whose stops are already in the database, for example:
+
+    TRANSIT_APIS = {
+        'Metrorail': (
+            'transitapis.apis.fake.Fake',
+            { 'latency': 0.2, 'error_rate': 0.1, }
+        ),
+    }
+
+    All options are optional. Each request takes about 'latency' seconds,
+    fails with an IOError with probability 'error_rate', and returns
+    'predictions' predictions per stop. 'max_batch_size' sets how many
+    stops one request can answer.
+    """
+    routes = ['Red', 'Blue', 'Orange', 'Green', 'Yellow']
+    destinations = ['Inbound', 'Outbound']
+
+    def __init__(self, name, options={}):
+        Base.__init__(self, name, options)
+        self.max_batch_size = int(self.options.get('max_batch_size', 1))
+
+    def request(self):
+        time.sleep(random.expovariate(1.0 / float(self.options.get('latency', 0.05))))
+        if random.random() < float(self.options.get('error_rate', 0)):
+            raise IOError('Fake error from %s' % self.name)
+
+    def make_predictions(self, stop, query_time):
+        return [Prediction(
+                    retrieved=query_time,
+                    stop=stop,
+                    route=random.choice(self.routes),
+                    destination=random.choice(self.destinations),
+                    wait=str(random.randint(0, 30)))
+                for i in range(int(self.options.get('predictions', 3)))]
+
+    def get_all_stops(self):
+        return []
+
+    def get_predictions(self, stop):
+        query_time = datetime.now()
+        self.request()
+        return self.make_predictions(stop, query_time)
+
+    def get_predictions_many(self, stops):
+        query_time = datetime.now()
+        self.request()
+        return [self.make_predictions(stop, query_time) for stop in stops]
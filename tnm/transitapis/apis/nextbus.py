@@ -1,11 +1,11 @@
 import abc
-import urllib2
+import urllib
 
 from datetime import datetime
 from django.contrib.gis.geos import Point
 from transitapis.apis.base import Base
+from transitapis.apis.xmlstream import children, iterelements, local_name
 from transitapis.models import Stop, Prediction
-from xml.dom import minidom
 
 class NextBus(Base):
     """
@@ -56,6 +56,11 @@ class NextBus(Base):
 
         http://webservices.nextbus.com/service/publicXMLFeed?command=predictions&a=AGENCY_NAME=stopId=STOP_ID
 
+    To get predicted arrival times for many stops at once, identify each stop
+    by a route tag and a stop tag from the route list:
+
+        http://webservices.nextbus.com/service/publicXMLFeed?command=predictionsForMultiStops&a=AGENCY_NAME&stops=ROUTE_TAG|STOP_TAG&stops=...
+
     Successful calls return XML of the form:
 
         <?xml version="1.0" encoding="utf-8" ?>
@@ -69,37 +74,58 @@ class NextBus(Base):
         </predictions>
         </body>
 
+    Both calls return one predictions element for each route serving each
+    requested stop.
+
+    Since a stop can be served by several routes, the API data of each stop
+    is its stop ID followed by a ROUTE_TAG|STOP_TAG pair for each route that
+    serves it, separated by semicolons. Only the stop ID is part of the stop's
+    public code. Stops refreshed before the pairs were added only have a stop
+    ID, and get their predictions one at a time.
+
     """
     required_options = ['agency_id']
     base_url = 'http://webservices.nextbus.com/service/publicXMLFeed'
+    max_batch_size = 50
     
     def get_all_stops(self):
         url = '%s?command=routeConfig&a=%s' % (
             self.base_url,
             self.options['agency_id'])
 
-        try:
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        response = self.fetch(url)
 
-        dom = minidom.parse(response)
-        
-        stops = []
-        for stop_elem in dom.getElementsByTagName('stop'):
-            title = stop_elem.getAttribute('title')
-            lon = stop_elem.getAttribute('lon')
-            lat = stop_elem.getAttribute('lat')
-            stopId = stop_elem.getAttribute('stopId')
+        stops = {}
+        for elem_name, stop_elem, ancestors in iterelements(response, ['stop']):
+            title = stop_elem.get('title')
+            lon = stop_elem.get('lon')
+            lat = stop_elem.get('lat')
+            stopId = stop_elem.get('stopId')
+            tag = stop_elem.get('tag')
 
-            if title and lon and lat and stopId:
-                stops.append(Stop(
-                    name=title,
-                    location=Point(x=float(lon), y=float(lat), srid=4326),
-                    api_name=self.name,
-                    api_data=stopId))
+            # Stops listed under directions only repeat the route's stops.
+            parent = ancestors[-1]
+            if local_name(parent.tag) != 'route':
+                continue
+            route_tag = parent.get('tag')
 
-        return stops
+            if title and lon and lat and stopId:
+                stop = stops.get(stopId, None)
+                if not stop:
+                    stop = Stop(
+                        name=title,
+                        location=Point(x=float(lon), y=float(lat), srid=4326),
+                        api_name=self.name,
+                        api_data=stopId)
+                    stops[stopId] = stop
+                if route_tag and tag:
+                    stop.api_data += ';%s|%s' % (route_tag, tag)
+
+        return stops.values()
+
+    def _split_api_data(self, stop):
+        parts = stop.api_data.split(';')
+        return parts[0], parts[1:]
                 
     def get_predictions(self, stop):
         if not isinstance(stop, Stop):
@@ -108,33 +134,69 @@ class NextBus(Base):
         url = '%s?command=predictions&a=%s&stopId=%s' % (
             self.base_url,
             self.options['agency_id'],
-            stop.api_data)
+            self._split_api_data(stop)[0])
+
+        query_time = datetime.now()
+        response = self.fetch(url)
+
+        predictions = []
+        for elem_name, route_elem, ancestors in iterelements(response, ['predictions']):
+            predictions.extend(self._parse_predictions(stop, query_time, route_elem))
+
+        return predictions
+
+    def get_predictions_many(self, stops):
+        stops = list(stops)
+        results = []
+        pairs = {}
+        for i, stop in enumerate(stops):
+            if not isinstance(stop, Stop):
+                raise ValueError, stop
+
+            stopId, stop_pairs = self._split_api_data(stop)
+            if not stop_pairs:
+                results.append(self.get_predictions(stop))
+                continue
+
+            results.append([])
+            for pair in stop_pairs:
+                pairs.setdefault(pair, []).append(i)
+
+        pair_list = pairs.keys()
+        for start in range(0, len(pair_list), self.max_batch_size):
+            batch = pair_list[start:start + self.max_batch_size]
+            url = '%s?command=predictionsForMultiStops&a=%s&%s' % (
+                self.base_url,
+                self.options['agency_id'],
+                urllib.urlencode([('stops', pair) for pair in batch]))
 
-        try:
             query_time = datetime.now()
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+            response = self.fetch(url)
 
-        dom = minidom.parse(response)
-        
+            for elem_name, route_elem, ancestors in iterelements(response, ['predictions']):
+                pair = '%s|%s' % (route_elem.get('routeTag'), route_elem.get('stopTag'))
+                for i in pairs.get(pair, []):
+                    results[i].extend(
+                        self._parse_predictions(stops[i], query_time, route_elem))
+
+        return results
+
+    def _parse_predictions(self, stop, query_time, route_elem):
         predictions = []
-        for route_elem in dom.getElementsByTagName('predictions'):
-            route = route_elem.getAttribute('routeTitle')
+        route = route_elem.get('routeTitle')
 
-            for dir_elem in route_elem.getElementsByTagName('direction'):
-                direction = dir_elem.getAttribute('title')
+        for dir_elem in children(route_elem, 'direction'):
+            direction = dir_elem.get('title')
 
-                for pred_elem in dir_elem.getElementsByTagName('prediction'):
-                    minutes = pred_elem.getAttribute('minutes')
+            for pred_elem in children(dir_elem, 'prediction'):
+                minutes = pred_elem.get('minutes')
 
-                    if route and direction and minutes:
-                        predictions.append(Prediction(
-                            retrieved=query_time,
-                            stop=stop,
-                            route=route,
-                            destination=direction,
-                            wait=minutes))
+                if route and direction and minutes:
+                    predictions.append(Prediction(
+                        retrieved=query_time,
+                        stop=stop,
+                        route=route,
+                        destination=direction,
+                        wait=minutes))
 
         return predictions
-
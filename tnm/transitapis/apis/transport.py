@@ -0,0 +1,205 @@
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+import zlib
+
+from collections import deque
+from cStringIO import StringIO
+from django.conf import settings
+
+class HTTPError(IOError):
+    def __init__(self, url, status, reason):
+        IOError.__init__(self, 'HTTP %s %s from %s' % (status, reason, url))
+        self.url = url
+        self.status = status
+
+class ProviderStats(object):
+    """
+    Request counts and latencies of one transit API.
+    """
+    # Number of recent latencies kept for percentiles.
+    window = 1000
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.latencies = deque(maxlen=self.window)
+        self.lock = threading.Lock()
+
+    def record(self, duration_ms, error=False):
+        with self.lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self.total_ms += duration_ms
+            self.latencies.append(duration_ms)
+
+    def percentile(self, latencies, fraction):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def json_dict(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests, errors, total_ms = self.requests, self.errors, self.total_ms
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'mean_ms': total_ms / requests if requests else None,
+            'p50_ms': self.percentile(latencies, 0.5),
+            'p95_ms': self.percentile(latencies, 0.95),
+            'max_ms': latencies[-1] if latencies else None,
+        }
+
+class Transport(object):
+    """
+    HTTP client shared by the transit APIs.
+
+    Connections are kept alive and reused, up to max_idle of them per host,
+    so that most requests skip the DNS lookup and TCP (and TLS) handshake.
+    Every request has a connect timeout and a read timeout, asks for gzip
+    responses if gzip is set, and is counted in the stats of the API that
+    made it.
+    """
+    def __init__(self, connect_timeout, read_timeout, max_idle, gzip=True):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.gzip = gzip
+        self.idle = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get_connection(self, scheme, netloc, reuse=True):
+        if reuse:
+            with self.lock:
+                connections = self.idle.get((scheme, netloc), None)
+                if connections:
+                    return connections.pop(), True
+
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(netloc, timeout=self.connect_timeout)
+        else:
+            connection = httplib.HTTPConnection(netloc, timeout=self.connect_timeout)
+        connection.connect()
+        return connection, False
+
+    def put_connection(self, scheme, netloc, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def get_stats(self, provider):
+        stats = self.stats.get(provider, None)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.setdefault(provider, ProviderStats())
+        return stats
+
+    def is_stale(self, error):
+        """
+        Returns whether an error sending a request on a reused connection
+        means that the host had closed the connection while it was idle, so
+        that the request can be sent again on a new one. Timeouts never do,
+        so that a slow host costs only one timeout.
+        """
+        if isinstance(error, socket.timeout):
+            return False
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        return isinstance(error, socket.error) and \
+            error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+    def send(self, connection, path, headers, timeout):
+        connection.sock.settimeout(timeout)
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def request(self, scheme, netloc, path, headers, timeout):
+        connection, reused = self.get_connection(scheme, netloc)
+        try:
+            response = self.send(connection, path, headers, timeout)
+        except (httplib.HTTPException, socket.error), e:
+            connection.close()
+            if not reused or not self.is_stale(e):
+                raise
+            # Try once more, on a new connection.
+            connection, reused = self.get_connection(scheme, netloc, reuse=False)
+            try:
+                response = self.send(connection, path, headers, timeout)
+            except:
+                connection.close()
+                raise
+
+        try:
+            body = response.read()
+        except:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.put_connection(scheme, netloc, connection)
+        return response, body
+
+    def fetch(self, url, provider=None, timeout=None):
+        """
+        Gets a URL and returns its body as a file-like object. Raises
+        HTTPError for responses other than 200 OK, and socket.timeout if the
+        host doesn't connect in time or goes quiet for longer than timeout
+        seconds, which defaults to the transport's read timeout.
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if query:
+            path += '?' + query
+
+        headers = {}
+        if self.gzip:
+            headers['Accept-Encoding'] = 'gzip'
+
+        start = time.time()
+        error = True
+        try:
+            response, body = self.request(
+                scheme, netloc, path or '/', headers, timeout or self.read_timeout)
+            if response.status != httplib.OK:
+                raise HTTPError(url, response.status, response.reason)
+            if response.getheader('content-encoding', '') == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            error = False
+        finally:
+            self.get_stats(provider).record(1000 * (time.time() - start), error)
+
+        return StringIO(body)
+
+    def json_dict(self):
+        return dict((provider, stats.json_dict())
+                    for provider, stats in self.stats.items())
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """
+    Returns the process-wide transport configured in the project settings.
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport(
+                    connect_timeout=settings.TRANSIT_APIS_CONNECT_TIMEOUT,
+                    read_timeout=settings.TRANSIT_APIS_READ_TIMEOUT,
+                    max_idle=settings.TRANSIT_APIS_MAX_IDLE_CONNECTIONS,
+                    gzip=settings.TRANSIT_APIS_GZIP)
+    return _transport
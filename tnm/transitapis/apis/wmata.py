@@ -1,10 +1,13 @@
 import abc
 import json
-import urllib2
+import logging
+import threading
+import time
 
 from datetime import datetime
 from django.contrib.gis.geos import Point
 from transitapis.apis.base import Base
+from transitapis.apis.transport import get_transport
 from transitapis.models import Stop, Prediction
 
 class Metrorail(Base):
@@ -82,19 +85,26 @@ class Metrorail(Base):
     within the stop, usually 1 or 2. The "Min" field contains either an
     integer number of minutes, "ARR" for arriving, or "BRD" for boarding.
 
+    By default each call to get_predictions requests the codes of one stop.
+    Set the optional 'poll_interval' option to a number of seconds to instead
+    have a background thread request predictions for all stops that often,
+    and answer get_predictions from the latest response. If polling falls
+    behind by more than three intervals, for example because the API is
+    down, get_predictions goes back to requesting the stop's codes itself.
+
     """
     required_options = ['key']
     base_url = 'http://api.wmata.com'
 
+    # Polled predictions older than this many intervals are not used.
+    poll_max_intervals = 3
+
     def get_all_stops(self):
         url = '%s/Rail.svc/json/JStations?api_key=%s' % (
             self.base_url, 
             self.options['key'])
 
-        try:
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        response = self.fetch(url)
 
         data = response.read()
         json_data = json.loads(data)
@@ -125,22 +135,33 @@ class Metrorail(Base):
         if not isinstance(stop, Stop):
             raise ValueError, stop
 
+        poll_interval = self.options.get('poll_interval', None)
+        if poll_interval:
+            poller = get_train_poller(
+                self.name, self.base_url, self.options['key'], poll_interval)
+            polled = poller.get_trains(
+                stop.api_data.split(','),
+                poll_interval * self.poll_max_intervals)
+            if polled is not None:
+                query_time, trains = polled
+                return self._build_predictions(stop, query_time, trains)
+
         url = '%s/StationPrediction.svc/json/GetPrediction/%s?api_key=%s' % (
             self.base_url,
             stop.api_data,
             self.options['key'])
 
-        try:
-            query_time = datetime.now()
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        query_time = datetime.now()
+        response = self.fetch(url)
 
         data = response.read()
         json_data = json.loads(data)
-       
+
+        return self._build_predictions(stop, query_time, json_data['Trains'])
+
+    def _build_predictions(self, stop, query_time, trains):
         predictions = []
-        for train in json_data['Trains']:
+        for train in trains:
             prediction = Prediction(
                 retrieved=query_time,
                 stop=stop,
@@ -152,6 +173,81 @@ class Metrorail(Base):
 	            predictions.append(prediction)
 
         return predictions
+
+class TrainPoller(object):
+    """
+    Background thread that requests predictions for all Metrorail stops
+    every interval seconds and keeps the latest ones indexed by LocationCode.
+    """
+    def __init__(self, name, url, interval):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.trains = {}
+        self.query_time = None
+        self.updated = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            started = time.time()
+            try:
+                self.poll()
+            except Exception:
+                logging.getLogger('predictions').exception(
+                    'Error polling Metrorail predictions')
+            time.sleep(max(0, self.interval - (time.time() - started)))
+
+    def poll(self):
+        query_time = datetime.now()
+        response = get_transport().fetch(self.url, self.name)
+        json_data = json.loads(response.read())
+
+        trains = {}
+        for train in json_data['Trains']:
+            trains.setdefault(train['LocationCode'], []).append(train)
+
+        # Swap in the new index in one go so readers never see a partial one.
+        self.trains, self.query_time, self.updated = trains, query_time, time.time()
+
+    def get_trains(self, codes, max_age):
+        """
+        Returns (query_time, trains) for the given location codes from the
+        latest poll, or None if there is no poll younger than max_age seconds.
+        """
+        self.start()
+        trains, query_time, updated = self.trains, self.query_time, self.updated
+        if updated is None or time.time() - updated > max_age:
+            return None
+
+        return query_time, [train for code in codes for train in trains.get(code, [])]
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+def get_train_poller(name, base_url, key, interval):
+    """
+    Returns the process-wide poller for an API key, so that every Metrorail
+    object with the same key shares one stream of requests.
+    """
+    poller = _pollers.get(key, None)
+    if poller is None:
+        with _pollers_lock:
+            poller = _pollers.get(key, None)
+            if poller is None:
+                url = '%s/StationPrediction.svc/json/GetPrediction/All?api_key=%s' % (
+                    base_url, key)
+                poller = TrainPoller(name, url, interval)
+                _pollers[key] = poller
+    return poller
  
 class Metrobus(Base):
     """
@@ -224,10 +320,7 @@ class Metrobus(Base):
             self.base_url,
             self.options['key'])
 
-        try:
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        response = self.fetch(url)
 
         data = response.read()
         json_data = json.loads(data)
@@ -254,11 +347,8 @@ class Metrobus(Base):
             stop.api_data,
             self.options['key'])
 
-        try:
-            query_time = datetime.now()
-            response = urllib2.urlopen(url)
-        except urllib2.HttpError:
-            raise
+        query_time = datetime.now()
+        response = self.fetch(url)
 
         data = response.read()
         json_data = json.loads(data)
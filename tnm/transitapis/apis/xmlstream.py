@@ -0,0 +1,45 @@
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+def local_name(tag):
+    """
+    Returns a tag name without its namespace, so that documents match
+    whether or not they declare one.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+def children(elem, name):
+    return [child for child in elem if local_name(child.tag) == name]
+
+def iterelements(source, names):
+    """
+    Parses an XML document incrementally and yields (name, element,
+    ancestors) for each element with one of the given local names, as soon
+    as its end tag has been read. The element is complete, including its
+    children. ancestors is the list of its open parent elements, from the
+    root down, whose attributes are available but whose children are not.
+
+    Everything that isn't inside a yielded element is thrown away as soon as
+    it has been read, so memory use is bounded by the largest yielded
+    element rather than by the size of the document.
+    """
+    ancestors = []
+    kept = 0
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        name = local_name(elem.tag)
+        if event == 'start':
+            ancestors.append(elem)
+            if name in names:
+                kept += 1
+            continue
+
+        ancestors.pop()
+        if name in names:
+            kept -= 1
+            yield name, elem, ancestors
+
+        if not kept and ancestors:
+            # Drop this element and any earlier siblings; they're all done.
+            del ancestors[-1][:]
@@ -0,0 +1,304 @@
+import hashlib
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from django.conf import settings
+
+from transitapis.health import CircuitOpenError
+from transitapis.models import Prediction
+
+class LocalBackend(object):
+    """
+    In-process LRU store with per-entry timeouts. Each worker process has its
+    own copy, so use DjangoCacheBackend to share entries between workers.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key, value, timeout):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and entry[0] >= time.time():
+                return False
+            self.entries[key] = (time.time() + timeout, value)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class DjangoCacheBackend(object):
+    """
+    Store backed by one of the caches in settings.CACHES. Shared caches such
+    as memcached or the file-based cache let all workers use the same
+    predictions and coalesce their requests.
+    """
+    def __init__(self, cache_name):
+        from django.core.cache import get_cache
+        self.cache = get_cache(cache_name)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+class Unanswered(list):
+    """
+    Empty list of predictions for a stop that another caller was asking its
+    API about, when that caller got no answer. status is the status of
+    fetch_predictions to report for the stop.
+    """
+    def __init__(self, status):
+        list.__init__(self)
+        self.status = status
+
+class PredictionCache(object):
+    """
+    Cache of predictions by transit API stop.
+
+    Predictions are returned as they are for ttl seconds, or, if their API
+    said when they expire, until then but for no more than max_ttl seconds.
+    After that, they are still returned for stale_ttl more seconds, while a
+    background thread gets new ones from the API. When there are no
+    predictions at all, only one caller per stop asks the API, and any
+    other callers for the same stop wait for its answer, whether they are
+    in the same process or, with a shared backend, in another worker.
+
+    If that caller fails, the failure is kept for error_ttl seconds, and the
+    other callers and any that come along meanwhile get Unanswered instead
+    of asking the failing API themselves.
+    """
+    # Seconds between checks for predictions fetched by another worker.
+    poll_interval = 0.05
+
+    def __init__(self, backend, ttl, stale_ttl, lock_timeout, max_ttl=None,
+                 error_ttl=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_ttl = max_ttl if max_ttl is not None else ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.error_ttl = error_ttl
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def key(self, api_name, api_stop_id):
+        # Key by the API's own stop id, so that a stop keeps its entry when
+        # the rest of its API data, such as its NextBus routes, changes.
+        # Hash so that keys are safe for any cache backend.
+        return 'transitapis:predictions:' + hashlib.md5(
+            ('%s:%s' % (api_name, api_stop_id)).encode('utf-8')).hexdigest()
+
+    def build(self, stop, rows):
+        return [Prediction(
+                    retrieved=retrieved,
+                    stop=stop,
+                    route=route,
+                    destination=destination,
+                    wait=wait)
+                for retrieved, route, destination, wait in rows]
+
+    def store(self, key, predictions):
+        rows = [(p.retrieved, p.route, p.destination, p.wait) for p in predictions]
+
+        now = time.time()
+        ttl = self.ttl
+        expires = getattr(predictions, 'expires', None)
+        if expires is not None:
+            ttl = max(0, min(self.max_ttl, expires - now))
+        self.backend.set(key, (now + ttl, rows), ttl + self.stale_ttl)
+
+    def store_failure(self, keys, status):
+        # Waiting callers must see the failure before the flight ends.
+        if self.error_ttl:
+            for key in keys:
+                self.backend.set(key + ':failed', status, self.error_ttl)
+
+    def get_failure(self, key):
+        if not self.error_ttl:
+            return None
+        return self.backend.get(key + ':failed')
+
+    def claim(self, key):
+        """
+        Returns True if the caller should get predictions from the API, or
+        False if another caller is already doing so.
+        """
+        with self.lock:
+            if key in self.flights:
+                return False
+            self.flights[key] = threading.Event()
+
+        if not self.backend.add(key + ':lock', 1, self.lock_timeout):
+            # Another worker is fetching. Wait for it here, so that callers
+            # in this process wait for this one.
+            deadline = time.time() + self.lock_timeout
+            while time.time() < deadline:
+                if self.backend.get(key) is not None or \
+                    self.get_failure(key) is not None:
+                    break
+                time.sleep(self.poll_interval)
+            self.release(key, locked=False)
+            return False
+        return True
+
+    def release(self, key, locked=True):
+        if locked:
+            self.backend.delete(key + ':lock')
+        with self.lock:
+            flight = self.flights.pop(key, None)
+        if flight is not None:
+            flight.set()
+
+    def wait(self, key):
+        with self.lock:
+            flight = self.flights.get(key, None)
+        if flight is not None:
+            flight.wait(self.lock_timeout)
+
+    def fetch(self, api, stops, keys):
+        from transitapis.predictions import STATUS_ERROR, STATUS_UNAVAILABLE, \
+            request_predictions
+        try:
+            results = request_predictions(api, stops)
+            for key, predictions in zip(keys, results):
+                self.store(key, predictions)
+            return results
+        except CircuitOpenError:
+            self.store_failure(keys, STATUS_UNAVAILABLE)
+            raise
+        except Exception:
+            self.store_failure(keys, STATUS_ERROR)
+            raise
+        finally:
+            for key in keys:
+                self.release(key)
+
+    def refresh(self, api, stops, keys):
+        try:
+            self.fetch(api, stops, keys)
+        except CircuitOpenError:
+            pass
+        except Exception:
+            logging.getLogger('predictions').exception(
+                'Error refreshing predictions from %s for %s' % (
+                    api.name, ' '.join(stop.api_data for stop in stops)))
+
+    def get_predictions_many(self, api, stops):
+        """
+        Returns a list of predictions for each of the given stops of one API,
+        in the same order. The stops this caller has to get from the API are
+        requested together with get_predictions_many, and so are the stale
+        stops it refreshes.
+
+        Stops that another caller asked the API about without an answer get
+        Unanswered, whose status tells why.
+        """
+        from transitapis.predictions import STATUS_TIMEOUT
+
+        keys = [self.key(stop.api_name, stop.api_stop_id) for stop in stops]
+        results = [None] * len(stops)
+
+        stale = []
+        missing = []
+        waiting = []
+        for i, key in enumerate(keys):
+            entry = self.backend.get(key)
+            if entry is not None:
+                fresh_until, rows = entry
+                results[i] = self.build(stops[i], rows)
+                if time.time() >= fresh_until and self.claim(key):
+                    stale.append(i)
+            elif self.get_failure(key) is not None:
+                # The API failed moments ago; don't ask it again yet.
+                results[i] = Unanswered(self.get_failure(key))
+            elif self.claim(key):
+                missing.append(i)
+            else:
+                waiting.append(i)
+
+        if stale:
+            # Serve stale predictions while getting new ones.
+            from transitapis.predictions import get_pool
+            get_pool().apply_async(self.refresh, (
+                api, [stops[i] for i in stale], [keys[i] for i in stale]))
+
+        if missing:
+            fetched = self.fetch(
+                api, [stops[i] for i in missing], [keys[i] for i in missing])
+            for i, predictions in zip(missing, fetched):
+                results[i] = predictions
+
+        # Someone else is asking the API; use their answers if they got any.
+        # Asking the API again here would multiply the calls to an API
+        # that is failing or slow, so stops without answers stay unanswered.
+        for i in waiting:
+            self.wait(keys[i])
+            entry = self.backend.get(keys[i])
+            if entry is not None:
+                results[i] = self.build(stops[i], entry[1])
+            else:
+                results[i] = Unanswered(self.get_failure(keys[i]) or STATUS_TIMEOUT)
+
+        return results
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_prediction_cache():
+    """
+    Returns the process-wide prediction cache configured in the project
+    settings, or None if caching is disabled.
+
+    TRANSIT_APIS_CACHE_BACKEND is 'local' for a cache in each worker, or the
+    name of one of settings.CACHES to share predictions between workers.
+    """
+    global _cache
+    if not settings.TRANSIT_APIS_CACHE_BACKEND:
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if settings.TRANSIT_APIS_CACHE_BACKEND == 'local':
+                    backend = LocalBackend(settings.TRANSIT_APIS_CACHE_MAX_ENTRIES)
+                else:
+                    backend = DjangoCacheBackend(settings.TRANSIT_APIS_CACHE_BACKEND)
+
+                _cache = PredictionCache(
+                    backend,
+                    ttl=settings.TRANSIT_APIS_CACHE_TTL,
+                    stale_ttl=settings.TRANSIT_APIS_CACHE_STALE_TTL,
+                    max_ttl=settings.TRANSIT_APIS_CACHE_MAX_TTL,
+                    lock_timeout=settings.TRANSIT_APIS_TIMEOUT,
+                    error_ttl=settings.TRANSIT_APIS_CACHE_ERROR_TTL)
+    return _cache
@@ -0,0 +1,206 @@
+import BaseHTTPServer
+import json
+import logging
+import Queue
+import socket
+import SocketServer
+import time
+import urllib
+import urlparse
+
+from datetime import datetime
+from django.conf import settings
+from django.db import connection
+
+from transitapis.apis.transport import get_transport
+from transitapis.health import get_all_health
+from transitapis.models import Prediction, Stop
+from transitapis.predictions import STATUS_UNAVAILABLE, fetch_local_predictions
+from transitapis.stream import get_prediction_hub
+
+# How predictions' retrieval times travel between the gateway and its clients.
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def fetch_gateway_predictions(stops, timeout):
+    """
+    Gets predictions for transitapis stops from the prediction gateway at
+    settings.TRANSIT_APIS_GATEWAY, and returns them like fetch_predictions.
+    If the gateway can't be reached, every stop is unavailable.
+
+    The calling worker still waits for the answer, for up to timeout plus a
+    second. What the gateway saves is duplicate provider calls, caches,
+    pollers and connections in every worker, not the worker's wait.
+    """
+    stops = list(stops)
+    if not stops:
+        return []
+
+    query = [('stop', ('%s\t%s\t%s' % (stop.id, stop.api_name, stop.api_data)).encode('utf-8'))
+             for stop in stops]
+    query.append(('timeout', timeout))
+    url = '%s/predictions?%s' % (
+        settings.TRANSIT_APIS_GATEWAY.rstrip('/'), urllib.urlencode(query))
+
+    try:
+        # Allow the gateway its own timeout, plus time to answer.
+        response = get_transport().fetch(url, 'gateway', timeout=timeout + 1)
+        results = json.load(response)['results']
+    except Exception:
+        logging.getLogger('predictions').exception(
+            'Error getting predictions from gateway %s' % settings.TRANSIT_APIS_GATEWAY)
+        return [(stop, [], STATUS_UNAVAILABLE) for stop in stops]
+
+    return [(stop, [Prediction(
+                        retrieved=datetime.strptime(retrieved, TIME_FORMAT),
+                        stop=stop,
+                        route=route,
+                        destination=destination,
+                        wait=wait)
+                    for retrieved, route, destination, wait in result['predictions']],
+             result['status'])
+            for stop, result in zip(stops, results)]
+
+class GatewayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer each response and send it at once, so that small responses on
+    # kept-alive connections aren't held back by Nagle's algorithm.
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path == '/predictions':
+            try:
+                stops, timeout = self.parse_query(urlparse.parse_qs(url.query))
+            except ValueError:
+                self.send_error(400, 'Expected stop=ID%09API_NAME%09API_DATA&...&timeout=SECONDS')
+                return
+            try:
+                self.send_json(self.get_predictions(stops, timeout))
+            finally:
+                # Requests are answered on their own threads, which would
+                # leave any connection they opened idle in transaction.
+                connection.close()
+        elif url.path == '/stream':
+            try:
+                stop_ids = [int(stop_id) for stop_id in
+                            urlparse.parse_qs(url.query)['stops'][0].split(',')]
+            except (KeyError, ValueError):
+                self.send_error(400, 'Expected stops=ID,ID,...')
+                return
+            if len(stop_ids) > settings.TNM_PREDICTION_STREAM_MAX_STOPS:
+                self.send_error(400, 'At most %s stops are allowed' % settings.TNM_PREDICTION_STREAM_MAX_STOPS)
+                return
+            self.stream_predictions(stop_ids)
+        elif url.path == '/metrics':
+            self.send_json({
+                'providers': get_transport().json_dict(),
+                'health': dict((api_name, health.json_dict())
+                               for api_name, health in get_all_health().items()),
+            })
+        else:
+            self.send_error(404)
+
+    def parse_query(self, query):
+        """
+        Returns the stops and timeout of a predictions request, or raises
+        ValueError if they are malformed.
+        """
+        stops = []
+        for value in query.get('stop', []):
+            parts = value.decode('utf-8').split('\t', 2)
+            if len(parts) != 3:
+                raise ValueError(value)
+            stop_id, api_name, api_data = parts
+            stops.append(Stop(
+                id=int(stop_id) if stop_id != 'None' else None,
+                api_name=api_name,
+                api_data=api_data))
+
+        timeout = float(query.get('timeout', [settings.TRANSIT_APIS_TIMEOUT])[0])
+        return stops, timeout
+
+    def get_predictions(self, stops, timeout):
+        results = fetch_local_predictions(stops, timeout)
+
+        return {'results': [{
+            'status': status,
+            'predictions': [(p.retrieved.strftime(TIME_FORMAT), p.route, p.destination, p.wait)
+                            for p in predictions],
+        } for stop, predictions, status in results]}
+
+    def stream_predictions(self, stop_ids):
+        """
+        Sends the predictions of TNM stops as server-sent events, first the
+        latest known and then whenever they change, until the stream's
+        maximum duration is up or the client goes away.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = 1
+
+        hub = get_prediction_hub()
+        subscription = hub.subscribe(stop_ids)
+        try:
+            # Have browsers reconnect soon after the stream ends.
+            self.send_event('retry: 1000\n\n')
+
+            deadline = time.time() + settings.TNM_PREDICTION_STREAM_MAX_DURATION
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    data = subscription.queue.get(True,
+                        min(remaining, settings.TNM_PREDICTION_STREAM_KEEPALIVE))
+                except Queue.Empty:
+                    # Comments keep proxies from closing the connection, and
+                    # find out when the client has gone away.
+                    self.send_event(': keepalive\n\n')
+                    continue
+                self.send_event('event: predictions\ndata: %s\n\n' % data)
+        finally:
+            hub.unsubscribe(subscription)
+
+    def send_event(self, event):
+        self.wfile.write(event)
+        self.wfile.flush()
+
+    def send_json(self, data):
+        body = json.dumps(data, separators=(',', ':'))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            # The client went away, such as in the middle of a stream.
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def log_message(self, format, *args):
+        logging.getLogger('predictions').debug(format % args)
+
+class GatewayServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server that answers each prediction request and prediction stream
+    in its own thread, while the transit API calls themselves share the
+    process's thread pool, connections, cache and circuit breakers.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
@@ -0,0 +1,177 @@
+import threading
+import time
+
+from collections import deque
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpenError(Exception):
+    def __init__(self, api_name):
+        Exception.__init__(self, 'Not calling %s until it recovers' % api_name)
+        self.api_name = api_name
+
+class Health(object):
+    """
+    Circuit breaker and latency tracker for one transit API.
+
+    The breaker is closed while the API works, and every call goes through.
+    When at least min_failures of the last window calls, and at least
+    error_rate of them, failed or took longer than slow_call seconds, the
+    breaker opens and calls fail straight away with CircuitOpenError. After
+    backoff seconds it is half-open and lets a single call through: if that
+    succeeds it closes again, otherwise it opens for twice as long as the
+    last time, up to max_backoff seconds.
+
+    get_timeout() suggests how long to wait for the API to answer, based on
+    the 95th percentile latency of recent successful calls.
+    """
+    def __init__(self, api_name, window, min_failures, error_rate, slow_call,
+                 backoff, max_backoff, timeout_multiplier, min_timeout, max_timeout):
+        self.api_name = api_name
+        self.min_failures = min_failures
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        self.outcomes = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened = 0
+        self.open_until = None
+        self.probing = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN and time.time() >= self.open_until:
+                self.state = HALF_OPEN
+                self.probing = False
+
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record(self, success, duration):
+        if duration > self.slow_call:
+            success = False
+
+        with self.lock:
+            self.calls += 1
+            if success:
+                self.latencies.append(duration)
+            else:
+                self.failures += 1
+            self.outcomes.append(success)
+
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if success:
+                    self.state = CLOSED
+                    self.opened = 0
+                    self.outcomes.clear()
+                else:
+                    self.trip()
+            elif self.state == CLOSED:
+                failed = self.outcomes.count(False)
+                if failed >= self.min_failures and \
+                    failed >= self.error_rate * len(self.outcomes):
+                    self.trip()
+
+    def trip(self):
+        self.state = OPEN
+        self.opened += 1
+        backoff = min(self.max_backoff, self.backoff * 2 ** (self.opened - 1))
+        self.open_until = time.time() + backoff
+
+    def call(self, func, *args):
+        """
+        Calls func with the given arguments if the breaker allows it, and
+        records how that went. Raises CircuitOpenError otherwise.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.api_name)
+
+        start = time.time()
+        try:
+            result = func(*args)
+        except Exception:
+            self.record(False, time.time() - start)
+            raise
+        self.record(True, time.time() - start)
+        return result
+
+    def p95(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def get_timeout(self):
+        p95 = self.p95()
+        if p95 is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, self.timeout_multiplier * p95))
+
+    def json_dict(self):
+        with self.lock:
+            state, open_until = self.state, self.open_until
+            calls, failures, rejected = self.calls, self.failures, self.rejected
+            recent = list(self.outcomes)
+
+        p95 = self.p95()
+        return {
+            'state': state,
+            'open_until': open_until if state == OPEN else None,
+            'calls': calls,
+            'failures': failures,
+            'rejected': rejected,
+            'recent_error_rate': float(recent.count(False)) / len(recent) if recent else None,
+            'p95_ms': 1000 * p95 if p95 is not None else None,
+            'timeout': self.get_timeout(),
+        }
+
+_health = {}
+_health_lock = threading.Lock()
+
+def get_health(api_name):
+    """
+    Returns the process-wide Health of a transit API, configured from the
+    project settings.
+    """
+    health = _health.get(api_name, None)
+    if health is None:
+        with _health_lock:
+            health = _health.get(api_name, None)
+            if health is None:
+                health = Health(
+                    api_name,
+                    window=settings.TRANSIT_APIS_BREAKER_WINDOW,
+                    min_failures=settings.TRANSIT_APIS_BREAKER_MIN_FAILURES,
+                    error_rate=settings.TRANSIT_APIS_BREAKER_ERROR_RATE,
+                    slow_call=settings.TRANSIT_APIS_TIMEOUT,
+                    backoff=settings.TRANSIT_APIS_BREAKER_BACKOFF,
+                    max_backoff=settings.TRANSIT_APIS_BREAKER_MAX_BACKOFF,
+                    timeout_multiplier=settings.TRANSIT_APIS_TIMEOUT_P95_MULTIPLIER,
+                    min_timeout=settings.TRANSIT_APIS_MIN_READ_TIMEOUT,
+                    max_timeout=settings.TRANSIT_APIS_READ_TIMEOUT)
+                _health[api_name] = health
+    return health
+
+def get_all_health():
+    return dict(_health)
@@ -0,0 +1,175 @@
+import os
+import random
+import resource
+import tempfile
+import time
+
+from cPickle import dumps, loads
+from django.contrib.gis.geos import Point
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from xml.dom import minidom
+
+from transitapis.apis.connexionz import Connexionz
+from transitapis.apis.nextbus import NextBus
+from transitapis.models import Stop
+
+def minidom_nextbus_stops(api, source):
+    # How NextBus.get_all_stops parsed route lists before streaming.
+    dom = minidom.parse(source)
+    stops = []
+    for stop_elem in dom.getElementsByTagName('stop'):
+        title = stop_elem.getAttribute('title')
+        lon = stop_elem.getAttribute('lon')
+        lat = stop_elem.getAttribute('lat')
+        stopId = stop_elem.getAttribute('stopId')
+
+        if title and lon and lat and stopId:
+            stops.append(Stop(
+                name=title,
+                location=Point(x=float(lon), y=float(lat), srid=4326),
+                api_name=api.name,
+                api_data=stopId))
+    return stops
+
+def minidom_connexionz_stops(api, source):
+    # How Connexionz.get_all_stops parsed platform lists before streaming.
+    dom = minidom.parse(source)
+    stops = []
+    for platform_elem in dom.getElementsByTagName('Platform'):
+        tag = platform_elem.getAttribute('PlatformTag')
+        name = platform_elem.getAttribute('Name')
+
+        position_elems = platform_elem.getElementsByTagName('Position')
+        if 1 != len(position_elems):
+            continue
+
+        lat = position_elems[0].getAttribute('Lat')
+        lon = position_elems[0].getAttribute('Long')
+
+        if tag and name and lat and lon:
+            stops.append(Stop(
+                name=name,
+                location=Point(x=float(lon), y=float(lat), srid=4326),
+                api_name=api.name,
+                api_data=tag))
+    return stops
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--routeconfig',
+            action='store', dest='routeconfig', default=None,
+            help="Recorded NextBus routeConfig response to parse."),
+        make_option('--platforms',
+            action='store', dest='platforms', default=None,
+            help="Recorded Connexionz Platform.xml response to parse."),
+        make_option('--routes',
+            action='store', type='int', dest='routes', default=200,
+            help="Number of routes in generated documents (default 200)."),
+        make_option('--stops',
+            action='store', type='int', dest='stops', default=60,
+            help="Number of stops per generated route (default 60)."),
+        make_option('--points',
+            action='store', type='int', dest='points', default=2000,
+            help="Number of path points per generated route (default 2000)."),
+    )
+    help = "Compares time and memory of the DOM and streaming stop parsers."
+
+    def generate_routeconfig(self, f, routes, stops, points):
+        f.write('<?xml version="1.0" encoding="utf-8" ?>\n<body copyright="bench">\n')
+        for r in range(routes):
+            f.write('<route tag="r%d" title="Route %d" color="0000ff" oppositeColor="000000">\n' % (r, r))
+            for s in range(stops):
+                f.write('<stop tag="s%d_%d" title="Stop %d on route %d" lat="%f" lon="%f" stopId="%d"/>\n' % (
+                    r, s, s, r, 38.9 + random.random() / 10, -77.0 - random.random() / 10,
+                    random.randint(0, routes * stops / 2)))
+            f.write('<direction tag="r%d_0" title="Outbound" name="" useForUI="true">\n' % r)
+            for s in range(stops):
+                f.write('<stop tag="s%d_%d"/>\n' % (r, s))
+            f.write('</direction>\n<path>\n')
+            for p in range(points):
+                f.write('<point lat="%f" lon="%f"/>\n' % (
+                    38.9 + random.random() / 10, -77.0 - random.random() / 10))
+            f.write('</path>\n</route>\n')
+        f.write('</body>\n')
+
+    def generate_platforms(self, f, platforms):
+        f.write('<?xml version="1.0"?>\n<Platforms xmlns="urn:connexionz-co-nz">\n')
+        f.write('<Content Expires="2011-12-15T03:32:00-05:00" />\n')
+        for p in range(platforms):
+            f.write('<Platform PlatformTag="%d" PlatformNo="%d" Name="Platform %d" BearingToRoad="3.55e+002" RoadName="ROAD">\n' % (p, p, p))
+            f.write('<Position Lat="%f" Long="%f" />\n</Platform>\n' % (
+                38.9 + random.random() / 10, -77.0 - random.random() / 10))
+        f.write('</Platforms>\n')
+
+    def measure(self, func, api, path):
+        """
+        Runs func(api, file) in a child process, so that each parser starts
+        from the same memory footprint, and returns the number of stops,
+        seconds taken and growth of the peak resident set size in kB.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.time()
+            with open(path, 'rb') as source:
+                stops = func(api, source)
+            duration = time.time() - start
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, dumps((len(stops), duration, after - before)))
+            os._exit(0)
+
+        os.close(write_fd)
+        data = ''
+        while True:
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        return loads(data)
+
+    def handle_noargs(self, **options):
+        generated = []
+        routeconfig = options['routeconfig']
+        if not routeconfig:
+            fd, routeconfig = tempfile.mkstemp(suffix='.xml')
+            with os.fdopen(fd, 'w') as f:
+                self.generate_routeconfig(
+                    f, options['routes'], options['stops'], options['points'])
+            generated.append(routeconfig)
+
+        platforms = options['platforms']
+        if not platforms:
+            fd, platforms = tempfile.mkstemp(suffix='.xml')
+            with os.fdopen(fd, 'w') as f:
+                self.generate_platforms(f, options['routes'] * options['stops'])
+            generated.append(platforms)
+
+        nextbus = NextBus(name='NextBus', options={'agency_id': 'bench'})
+        connexionz = Connexionz(name='Connexionz', options={'url': 'bench'})
+
+        def streaming(api, source):
+            api.fetch = lambda url: source
+            return api.get_all_stops()
+
+        benchmarks = [
+            ('nextbus', nextbus, routeconfig, minidom_nextbus_stops),
+            ('connexionz', connexionz, platforms, minidom_connexionz_stops),
+        ]
+
+        try:
+            self.stdout.write("%10s %10s %10s %10s %10s %12s\n" % (
+                'document', 'size (kB)', 'parser', 'stops', 'time (s)', 'peak rss (kB)'))
+            for name, api, path, dom_func in benchmarks:
+                size = os.path.getsize(path) / 1024
+                for parser_name, func in [('minidom', dom_func), ('stream', streaming)]:
+                    count, duration, rss = self.measure(func, api, path)
+                    self.stdout.write("%10s %10d %10s %10d %10.2f %12d\n" % (
+                        name, size, parser_name, count, duration, rss))
+        finally:
+            for path in generated:
+                os.remove(path)
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from optparse import make_option
+
+from transitapis.apis import configure_apis, get_apis
+from transitapis.gateway import GatewayHandler, GatewayServer
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--host',
+            action='store', dest='host', default='127.0.0.1',
+            help="Address to listen on (default 127.0.0.1)."),
+        make_option('--port',
+            action='store', type='int', dest='port', default=8081,
+            help="Port to listen on (default 8081)."),
+        make_option('--fake',
+            action='store_true', dest='fake', default=False,
+            help="Replace every configured API with a fake one."),
+        make_option('--fake-latency',
+            action='store', type='float', dest='fake_latency', default=0.2,
+            help="Mean seconds each fake API request takes (default 0.2)."),
+        make_option('--fake-error-rate',
+            action='store', type='float', dest='fake_error_rate', default=0.0,
+            help="Fraction of fake API requests that fail (default 0)."),
+    )
+    help = "Serves predictions from transit APIs to the web workers over HTTP."
+
+    def handle_noargs(self, **options):
+        if settings.TRANSIT_APIS_GATEWAY:
+            # The gateway itself must call the APIs, not another gateway.
+            settings.TRANSIT_APIS_GATEWAY = None
+
+        if options['fake']:
+            configure_apis(dict((api_name, (
+                    'transitapis.apis.fake.Fake', {
+                        'latency': options['fake_latency'],
+                        'error_rate': options['fake_error_rate'],
+                    }))
+                for api_name in settings.TRANSIT_APIS))
+
+        # Create the APIs now so that pollers and connections are ready.
+        for api in get_apis().values():
+            self.stdout.write("Using API '%s' (%s).\n" % (
+                api.name, api.__class__.__name__))
+
+        try:
+            server = GatewayServer((options['host'], options['port']), GatewayHandler)
+        except Exception, e:
+            raise CommandError("Can't listen on %s:%s: %s" % (
+                options['host'], options['port'], e))
+
+        self.stdout.write("Serving predictions on http://%s:%s/predictions\n" % (
+            options['host'], options['port']))
+        self.stdout.write("Streaming predictions on http://%s:%s/stream\n" % (
+            options['host'], options['port']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -1,10 +1,13 @@
+from datetime import datetime
 from django.conf import settings
 from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
 from optparse import make_option
 
 from transitapis.apis import get_apis
-from transitapis.models import Stop
- 
+from transitapis.models import Refresh, Stop
+from transitapis.signals import stops_refreshed
+
 class Command(NoArgsCommand):
     option_list = NoArgsCommand.option_list + (
         make_option('--nowarning',
@@ -13,18 +16,23 @@ class Command(NoArgsCommand):
         make_option('-n', '--dry-run',
             action='store_true', dest='dry_run', default=False,
             help="Do everything except modify the database."),
+        make_option('-f', '--force',
+            action='store_true', dest='force', default=False,
+            help="Get stops even from APIs whose stops haven't expired yet."),
     )
     help = "Calls available transit APIs to get a list of stops."
 
     def handle_noargs(self, **options):
         self.warning = options['warning']
         self.dry_run = options['dry_run']
+        self.force = options['force']
 
         if self.warning and not self.dry_run:
             confirm = raw_input(u"""
 You have requested calling available transit APIs to get a list of stops.
 
-Doing this will erase all existing stops stored for these APIs.
+Doing this will erase all existing stops stored for APIs whose stops have
+expired, and for APIs that are no longer configured.
 Are you sure you want to do this?
 
 Type 'yes' to continue, or 'no' to cancel: """)
@@ -32,24 +40,59 @@ Type 'yes' to continue, or 'no' to cancel: """)
             if confirm != 'yes':
                 raise CommandError("Stop refreshing cancelled.")
 
+        apis = get_apis()
+
         if not self.dry_run:
-            Stop.objects.all().delete()
+            removed = Stop.objects.exclude(api_name__in=apis.keys())
+            if removed.exists():
+                with transaction.commit_on_success():
+                    api_names = list(removed.values_list('api_name', flat=True).distinct())
+                    removed.delete()
+                    Refresh.objects.exclude(api_name__in=apis.keys()).delete()
+                    stops_refreshed.send(sender=Stop, api_names=api_names)
 
-        apis = get_apis()
+        now = datetime.now()
         for api in apis.values():
+            if not self.force:
+                try:
+                    refresh = Refresh.objects.get(api_name=api.name)
+                except Refresh.DoesNotExist:
+                    refresh = None
+
+                if refresh and refresh.expires and refresh.expires > now:
+                    self.stdout.write("Skipping API '%s', stops expire at %s.\n\n" % (
+                        api.name, refresh.expires))
+                    continue
+
             self.stdout.write("Calling API '%s'.\n" % api.name)
-            
+
             for k, v in api.options.iteritems():
                 self.stdout.write("Using option: %s = %s\n" % (k, v))
 
             stops = api.get_all_stops()
+            expires = getattr(stops, 'expires', None)
+            if expires is not None:
+                expires = datetime.fromtimestamp(expires)
+                self.stdout.write("Stops expire at %s.\n" % expires)
+
             for stop in stops:
                 self.stdout.write("Found stop: '%s'\n" % stop.name)
-                    
-                if not self.dry_run:
-                    stop.save()
+
+            if not self.dry_run:
+                with transaction.commit_on_success():
+                    Stop.objects.filter(api_name=api.name).delete()
+                    for stop in stops:
+                        stop.save()
+
+                    refresh, created = Refresh.objects.get_or_create(
+                        api_name=api.name, defaults={'refreshed': now})
+                    refresh.refreshed = now
+                    refresh.expires = expires
+                    refresh.save()
+
+                    stops_refreshed.send(sender=Stop, api_names=[api.name])
 
             self.stdout.write('\n')
-        
+
         if self.dry_run:
             self.stdout.write("This was just a dry run!\n")
@@ -12,13 +12,19 @@ class Stop(models.Model):
     def __unicode__(self):
         return self.name
 
+    @property
+    def api_stop_id(self):
+        # APIs may follow the stop's own id with data of their own, after a
+        # semicolon, such as the route and stop tags of NextBus stops.
+        return self.api_data.split(';', 1)[0]
+
     def json_dict(self):
         return {
             'name': self.name,
             'api_name': self.api_name,
             'lat': self.location.y,
             'lng': self.location.x,
-            'code': self.api_name.lower().replace(' ','-') + ':' + self.api_data, # normalize to lower case without spaces
+            'code': self.api_name.lower().replace(' ','-') + ':' + self.api_stop_id, # normalize to lower case without spaces
         }
 
             
@@ -38,3 +44,33 @@ class Prediction(models.Model):
             'destination': self.destination,
             'wait': str(self.wait),
         }
+
+class RecordedPrediction(models.Model):
+    """
+    A prediction kept by transitapis.recorder.Recorder. Its stop is
+    identified by API name and the API's stop id rather than a foreign key,
+    so that refreshstops can replace stops without deleting or orphaning
+    history. Rows are stored in monthly tables that inherit from this
+    model's table.
+    """
+    retrieved = models.DateTimeField()
+    api_name = StringField()
+    api_stop_id = StringField()
+    route = StringField(null=True)
+    destination = StringField(null=True)
+    wait = StringField(null=True)
+
+    def __unicode__(self):
+        return '%s %s %s %s' % (self.api_name, self.route, self.destination, self.wait)
+
+class Refresh(models.Model):
+    """
+    When refreshstops last got the stops of a transit API, and until when
+    the API said they would stay valid.
+    """
+    api_name = StringField(unique=True)
+    refreshed = models.DateTimeField()
+    expires = models.DateTimeField(null=True)
+
+    def __unicode__(self):
+        return '%s %s' % (self.api_name, self.refreshed)
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from transitapis.apis import get_apis
+from transitapis.cache import get_prediction_cache
+from transitapis.health import CircuitOpenError, get_health
+from transitapis.recorder import get_recorder
+
+# Status of a stop's predictions, from best to worst.
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'
+STATUS_UNAVAILABLE = 'unavailable'
+STATUSES = [STATUS_OK, STATUS_TIMEOUT, STATUS_ERROR, STATUS_UNAVAILABLE]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide thread pool used to call transit APIs.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(settings.TRANSIT_APIS_THREADS)
+    return _pool
+
+def request_predictions(api, stops):
+    """
+    Asks an API for predictions for some of its stops through its circuit
+    breaker, and records what it answers if recording is enabled.
+    """
+    results = get_health(api.name).call(api.get_predictions_many, stops)
+
+    recorder = get_recorder()
+    if recorder:
+        for predictions in results:
+            recorder.record(predictions)
+
+    return results
+
+def fetch_predictions(stops, timeout=None):
+    """
+    Gets predictions for transitapis stops from their APIs concurrently, or
+    from the prediction gateway if settings.TRANSIT_APIS_GATEWAY is set.
+
+    Stops are grouped by API, and each API is asked for up to its
+    max_batch_size stops at a time with get_predictions_many.
+
+    Returns a list of (stop, predictions, status) tuples in the same order
+    as the given stops, where status is one of STATUSES. Stops whose API
+    didn't answer successfully within timeout seconds of the call have an
+    empty list of predictions.
+    """
+    if timeout is None:
+        timeout = settings.TRANSIT_APIS_TIMEOUT
+
+    if settings.TRANSIT_APIS_GATEWAY:
+        from transitapis.gateway import fetch_gateway_predictions
+        return fetch_gateway_predictions(stops, timeout)
+    return fetch_local_predictions(stops, timeout)
+
+def fetch_local_predictions(stops, timeout):
+    """
+    Gets predictions for transitapis stops from their APIs in this process.
+    """
+    deadline = time.time() + timeout
+
+    apis = get_apis()
+    pool = get_pool()
+    cache = get_prediction_cache()
+
+    stops = list(stops)
+    results = [(stop, [], STATUS_UNAVAILABLE) for stop in stops]
+
+    groups = {}
+    for i, stop in enumerate(stops):
+        if stop.api_name in apis:
+            groups.setdefault(stop.api_name, []).append(i)
+
+    pending = []
+    for api_name, indexes in groups.iteritems():
+        api = apis[api_name]
+        for start in range(0, len(indexes), api.max_batch_size):
+            batch = indexes[start:start + api.max_batch_size]
+            batch_stops = [stops[i] for i in batch]
+            if cache:
+                async_result = pool.apply_async(cache.get_predictions_many, (api, batch_stops))
+            else:
+                async_result = pool.apply_async(request_predictions, (api, batch_stops))
+            pending.append((batch, async_result))
+
+    for batch, async_result in pending:
+        try:
+            batch_predictions = async_result.get(max(0, deadline - time.time()))
+        except TimeoutError:
+            for i in batch:
+                results[i] = (stops[i], [], STATUS_TIMEOUT)
+        except CircuitOpenError:
+            # The API has been failing; don't wait for it until it recovers.
+            for i in batch:
+                results[i] = (stops[i], [], STATUS_UNAVAILABLE)
+        except Exception:
+            logging.getLogger('predictions').exception(
+                'Error getting predictions from %s for %s' % (
+                    stops[batch[0]].api_name,
+                    ' '.join(stops[i].api_data for i in batch)))
+            for i in batch:
+                results[i] = (stops[i], [], STATUS_ERROR)
+        else:
+            for i, predictions in zip(batch, batch_predictions):
+                # Stops the cache couldn't answer say why.
+                status = getattr(predictions, 'status', STATUS_OK)
+                results[i] = (stops[i], predictions, status)
+
+    return results
+
+def worst_status(a, b):
+    if a is None:
+        return b
+    return max(a, b, key=STATUSES.index)
@@ -0,0 +1,202 @@
+import atexit
+import logging
+import os
+import threading
+
+from collections import deque
+from cStringIO import StringIO
+from datetime import date
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from transitapis.models import RecordedPrediction
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+
+class Recorder(object):
+    """
+    Keeps a history of the predictions that transit APIs returned.
+
+    record() only adds predictions to an in-memory buffer of at most
+    max_buffered rows, so it never waits for the database. When the buffer
+    is full, the policy decides whether the new predictions (DROP_NEWEST) or
+    the oldest buffered ones (DROP_OLDEST) are dropped; either way they are
+    counted. A background thread copies the buffer into the database every
+    interval seconds, or sooner once batch_size rows are waiting, with
+    PostgreSQL's COPY.
+
+    Rows go into one table per month, such as
+    transitapis_recordedprediction_y2012m01, which inherits from the
+    RecordedPrediction model's table and is created when first needed.
+    Queries on transitapis_recordedprediction see every month, and with
+    constraint_exclusion, queries on a time range only scan the months they
+    need. Old months can be dropped as whole tables. Rows name their stop by
+    API name and the API's stop id, with no foreign key, so the history stays
+    intact and in one series when refreshstops replaces stops, even if the
+    rest of their API data changes.
+    """
+    columns = ('retrieved', 'api_name', 'api_stop_id', 'route', 'destination', 'wait')
+
+    def __init__(self, max_buffered, batch_size, interval, policy=DROP_NEWEST):
+        self.max_buffered = max_buffered
+        self.batch_size = batch_size
+        self.interval = interval
+        self.policy = policy
+        self.buffer = deque()
+        self.partitions = set()
+        self.recorded = 0
+        self.dropped = 0
+        self.errors = 0
+        self.pid = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Threads don't survive a fork, so each uWSGI worker starts its own.
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.flush)
+
+    def record(self, predictions):
+        if self.pid != os.getpid():
+            self.start()
+
+        rows = [(p.retrieved, p.stop.api_name, p.stop.api_stop_id,
+                 p.route, p.destination, p.wait)
+                for p in predictions]
+        with self.lock:
+            if self.policy == DROP_OLDEST:
+                if len(rows) > self.max_buffered:
+                    self.dropped += len(rows) - self.max_buffered
+                    rows = rows[-self.max_buffered:]
+                while self.buffer and len(self.buffer) + len(rows) > self.max_buffered:
+                    self.buffer.popleft()
+                    self.dropped += 1
+            else:
+                room = max(0, self.max_buffered - len(self.buffer))
+                if len(rows) > room:
+                    self.dropped += len(rows) - room
+                    rows = rows[:room]
+            self.buffer.extend(rows)
+            full = len(self.buffer) >= self.batch_size
+
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def take(self):
+        with self.lock:
+            rows = list(self.buffer)
+            self.buffer.clear()
+        return rows
+
+    def flush(self):
+        rows = self.take()
+        if not rows:
+            return
+
+        months = {}
+        for row in rows:
+            months.setdefault((row[0].year, row[0].month), []).append(row)
+
+        for (year, month), month_rows in months.iteritems():
+            try:
+                self.copy(self.get_partition(year, month), month_rows)
+                self.recorded += len(month_rows)
+            except Exception:
+                transaction.rollback_unless_managed()
+                self.errors += 1
+                logging.getLogger('predictions').exception(
+                    'Error recording %d predictions' % len(month_rows))
+
+    def get_partition(self, year, month):
+        parent = RecordedPrediction._meta.db_table
+        name = '%s_y%04dm%02d' % (parent, year, month)
+        if name in self.partitions:
+            return name
+
+        start = date(year, month, 1)
+        end = date(year + month / 12, month % 12 + 1, 1)
+
+        if not self.partition_exists(name):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    'CREATE TABLE %s (CHECK (retrieved >= %%s AND retrieved < %%s)) '
+                    'INHERITS (%s)' % (name, parent), [start, end])
+                cursor.execute('CREATE INDEX %s_retrieved ON %s (retrieved)' % (name, name))
+                transaction.commit_unless_managed()
+            except DatabaseError:
+                transaction.rollback_unless_managed()
+                # Fine if another worker created it first.
+                if not self.partition_exists(name):
+                    raise
+
+        self.partitions.add(name)
+        return name
+
+    def partition_exists(self, name):
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1 FROM pg_class WHERE relname = %s', [name])
+        return cursor.fetchone() is not None
+
+    def copy(self, table, rows):
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join(self.escape(value) for value in row))
+            data.write('\n')
+        data.seek(0)
+
+        cursor = connection.cursor()
+        cursor.copy_from(data, table, columns=self.columns)
+        transaction.commit_unless_managed()
+
+    def escape(self, value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t') \
+            .replace('\n', '\\n').replace('\r', '\\r')
+
+    def json_dict(self):
+        return {
+            'buffered': len(self.buffer),
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder():
+    """
+    Returns the process-wide prediction recorder configured in the project
+    settings, or None if recording is disabled.
+    """
+    global _recorder
+    if not settings.TRANSIT_APIS_RECORDER:
+        return None
+
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = Recorder(
+                    max_buffered=settings.TRANSIT_APIS_RECORDER_MAX_BUFFERED,
+                    batch_size=settings.TRANSIT_APIS_RECORDER_BATCH_SIZE,
+                    interval=settings.TRANSIT_APIS_RECORDER_INTERVAL,
+                    policy=settings.TRANSIT_APIS_RECORDER_POLICY)
+    return _recorder
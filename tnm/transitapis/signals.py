@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent by refreshstops inside the transaction that replaces the stops of
+# transit APIs, with the names of those APIs. Anything associated with the
+# deleted stops went with them.
+stops_refreshed = Signal(providing_args=['api_names'])
@@ -0,0 +1,149 @@
+import logging
+import os
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.importlib import import_module
+
+class Subscription(object):
+    """
+    A client's interest in the predictions of some stops. The hub puts the
+    rendered predictions of a stop on the queue whenever they change.
+    """
+    max_queued = 100
+
+    def __init__(self, stop_ids):
+        self.stop_ids = frozenset(stop_ids)
+        self.queue = Queue.Queue(self.max_queued)
+
+    def push(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except Queue.Full:
+            # The client isn't keeping up; it gets the next change instead.
+            pass
+
+class PredictionHub(object):
+    """
+    Refreshes the predictions of every stop that somebody is subscribed to
+    every interval seconds, from one background thread per process, and
+    pushes any that changed to their subscribers. However many clients watch
+    a stop, its transit APIs are asked about it once per interval. The
+    prediction gateway serves the subscribers, one thread each.
+
+    New subscribers get the latest predictions straight away, and stops
+    nobody was watching yet are refreshed without waiting for the interval.
+
+    get_predictions is called with a list of stop ids, and returns the
+    rendered predictions of those stops by id.
+    """
+    def __init__(self, interval, get_predictions):
+        self.interval = interval
+        self.get_predictions = get_predictions
+        self.subscriptions = set()
+        self.latest = {}
+        self.pending = set()
+        self.pid = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Threads don't survive a fork, so each process starts its own.
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+
+    def subscribe(self, stop_ids):
+        if self.pid != os.getpid():
+            self.start()
+
+        subscription = Subscription(stop_ids)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            for stop_id in subscription.stop_ids:
+                data = self.latest.get(stop_id, None)
+                if data is None:
+                    self.pending.add(stop_id)
+                else:
+                    subscription.push(data)
+
+        if self.pending:
+            self.wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def run(self):
+        next_refresh = time.time()
+        while True:
+            self.wakeup.wait(max(0, next_refresh - time.time()))
+            self.wakeup.clear()
+
+            with self.lock:
+                subscribed = set()
+                for subscription in self.subscriptions:
+                    subscribed.update(subscription.stop_ids)
+                pending, self.pending = self.pending, set()
+
+            if time.time() >= next_refresh:
+                next_refresh = time.time() + self.interval
+                stop_ids = subscribed
+            else:
+                stop_ids = pending & subscribed
+
+            try:
+                self.refresh(stop_ids, subscribed)
+            except Exception:
+                logging.getLogger('predictions').exception(
+                    'Error refreshing streamed predictions')
+
+    def refresh(self, stop_ids, subscribed):
+        changed = {}
+        if stop_ids:
+            try:
+                for stop_id, data in self.get_predictions(list(stop_ids)).iteritems():
+                    if self.latest.get(stop_id, None) != data:
+                        changed[stop_id] = data
+            finally:
+                # No request ends on this thread to close the connection,
+                # which would otherwise stay idle in transaction and hold
+                # locks that keep builddb from changing the stop tables.
+                connection.close()
+
+        with self.lock:
+            # Forget stops that nobody watches anymore.
+            for stop_id in self.latest.keys():
+                if stop_id not in subscribed:
+                    del self.latest[stop_id]
+            self.latest.update(changed)
+
+            for subscription in self.subscriptions:
+                for stop_id in subscription.stop_ids:
+                    if stop_id in changed:
+                        subscription.push(changed[stop_id])
+
+_hub = None
+_hub_lock = threading.Lock()
+
+def get_prediction_hub():
+    """
+    Returns the process-wide prediction hub, which gets predictions from the
+    function named by settings.TNM_PREDICTION_STREAM_SOURCE.
+    """
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                module_name, func_name = \
+                    settings.TNM_PREDICTION_STREAM_SOURCE.rsplit('.', 1)
+                _hub = PredictionHub(settings.TNM_PREDICTION_STREAM_INTERVAL,
+                    getattr(import_module(module_name), func_name))
+    return _hub
@@ -5,4 +5,5 @@ urlpatterns = patterns('transitapis.views',
     (r'^$', direct_to_template, {'template': 'transitapis/predictions.html'}),
     url(r'^stops', 'stops', name='stops'),
     url(r'^predictions', 'predictions', name='predictions'),
+    url(r'^metrics$', 'metrics', name='metrics'),
 )
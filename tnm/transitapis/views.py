@@ -3,8 +3,13 @@ import json
 from django.conf import settings
 from django.contrib.gis.geos import Point, LinearRing
 from django.http import HttpResponse, HttpResponseBadRequest
-from transitapis.apis import get_apis
+from django.utils.cache import patch_cache_control
+
+from transitapis.apis.transport import get_transport
+from transitapis.health import get_all_health
+from transitapis.recorder import get_recorder
 from transitapis.models import Stop
+from transitapis.predictions import fetch_predictions
 
 def stops(request):
     nwLat = request.GET.get('nwLat', None)
@@ -25,29 +30,40 @@ def stops(request):
 
     stop_data = dict([(s.id, s.json_dict()) for s in stops])
     data = json.dumps(stop_data)
-    return HttpResponse(data, content_type='application/json') 
+    response = HttpResponse(data, content_type='application/json') 
+    patch_cache_control(response, public=True, max_age=settings.TNM_DATASET_MAX_AGE)
+    return response
 
 def predictions(request):
     stops_query = request.GET.get('stops', None)
     if stops_query is None:
         return HttpResponseBadRequest('Missing parameters')
 
-    apis = get_apis() 
-
     stop_ids = [int(stop_id) for stop_id in stops_query.split(',')]
     stops = Stop.objects.filter(id__in=stop_ids)
 
     prediction_data = {}
-    for stop in stops:
-        api = apis.get(stop.api_name, None)
-        if not api:
-            continue
-    
-        predictions = api.get_predictions(stop)
+    for stop, predictions, status in fetch_predictions(stops):
         if not len(predictions):
             continue
 
         prediction_data[stop.id] = [p.json_dict() for p in predictions]
         
     data = json.dumps(prediction_data)
-    return HttpResponse(data, content_type='application/json')
+    response = HttpResponse(data, content_type='application/json')
+    patch_cache_control(response, public=True, max_age=settings.TNM_PREDICTIONS_MAX_AGE)
+    return response
+
+def metrics(request):
+    data = {
+        'providers': get_transport().json_dict(),
+        'health': dict((api_name, health.json_dict())
+                       for api_name, health in get_all_health().items()),
+    }
+    recorder = get_recorder()
+    if recorder:
+        data['recorder'] = recorder.json_dict()
+    data = json.dumps(data)
+    response = HttpResponse(data, content_type='application/json')
+    patch_cache_control(response, no_cache=True)
+    return response
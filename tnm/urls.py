@@ -1,6 +1,9 @@
 from django.conf.urls.defaults import patterns, include, url
 from django.contrib.gis import admin
 
+import transitapis.views
+from api.versions import dataset_conditional
+
 admin.autodiscover()
 
 urlpatterns = patterns('',
@@ -11,6 +14,12 @@ urlpatterns += patterns('',
     url(r'^admin/', include(admin.site.urls)),
 )
 
+# Transit API stops only change with the dataset, which the transitapis
+# app doesn't know about, so add the dataset's validators here.
+urlpatterns += patterns('',
+    (r'^transitapis/stops', dataset_conditional(transitapis.views.stops)),
+)
+
 urlpatterns += patterns('',
 	(r'^', include('client.urls')),
 	(r'^api/', include('api.urls')),
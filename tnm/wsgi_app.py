@@ -3,3 +3,17 @@ import os, sys, django.core.handlers.wsgi
 sys.path.append(os.path.dirname(__file__))
 os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
 application = django.core.handlers.wsgi.WSGIHandler()
+
+# Load the stop index now rather than on the first request.
+from django.conf import settings
+if settings.TNM_STOP_INDEX:
+    from api.index import get_stop_index
+    from django.db import connection
+    get_stop_index()
+
+    # Don't let forked workers share the connection used to load it.
+    connection.close()
+
+# Read the transit API settings once per worker; APIs are created on first use.
+from transitapis.apis import get_apis
+get_apis()